@@ -0,0 +1,121 @@
+import time
+import random
+import argparse
+
+import numpy as np
+from transformers import AutoTokenizer
+
+from dataset import PIIDataset
+from decode import batch_bio_to_spans
+from labels import LABELS
+from predict import bio_to_spans, forward_sorted, load_model
+
+
+def corrupt(label_ids, rng, p):
+    # random relabelling exercises I-after-O, type switches and unknown ids
+    n = len(LABELS)
+    return [rng.randrange(-1, n + 1) if rng.random() < p else lid for lid in label_ids]
+
+
+def pad(rows, offsets):
+    """Padded arrays, as they come out of a batched forward pass."""
+    width = max(len(r) for r in rows)
+    ids_pad = np.zeros((len(rows), width), dtype=np.int64)
+    off_pad = np.zeros((len(rows), width, 2), dtype=np.int64)
+    for i, (r, o) in enumerate(zip(rows, offsets)):
+        ids_pad[i, :len(r)] = r
+        off_pad[i, :len(o)] = o
+    return ids_pad, off_pad
+
+
+def check(name, rows, offsets, texts):
+    """Diffs the ragged and padded batch decoder against `bio_to_spans` row by row."""
+    ref = [bio_to_spans(t, o, l) for t, o, l in zip(texts, offsets, rows)]
+    n_spans = sum(len(r) for r in ref)
+    ok = True
+    for form, got in (("ragged", batch_bio_to_spans(rows, offsets)),
+                      ("padded", batch_bio_to_spans(*pad(rows, offsets)))):
+        bad = [i for i, (a, b) in enumerate(zip(ref, got)) if a != b]
+        status = "OK" if not bad else f"MISMATCH in {len(bad)} rows (first: {bad[0]})"
+        print(f"{name + ' ' + form:36s} rows={len(rows):6d} spans={n_spans:6d} {status}")
+        ok &= not bad
+    return ok
+
+
+def bench(rows, offsets, texts, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for t, o, l in zip(texts, offsets, rows):
+            bio_to_spans(t, o, l)
+    loop = (time.perf_counter() - t0) / repeat
+
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        batch_bio_to_spans(rows, offsets)
+    vec = (time.perf_counter() - t0) / repeat
+
+    ids_pad, off_pad = pad(rows, offsets)
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        batch_bio_to_spans(ids_pad, off_pad)
+    padded = (time.perf_counter() - t0) / repeat
+
+    n = len(rows)
+    print(f"\nDecode {n} utterances (mean of {repeat} runs):")
+    print(f"  bio_to_spans loop:            {loop * 1000:8.2f} ms  ({loop / n * 1e6:6.1f} us/utt)")
+    print(f"  batch_bio_to_spans (ragged):  {vec * 1000:8.2f} ms  ({vec / n * 1e6:6.1f} us/utt)"
+          f"  {loop / max(vec, 1e-12):.1f}x")
+    print(f"  batch_bio_to_spans (padded):  {padded * 1000:8.2f} ms  ({padded / n * 1e6:6.1f} us/utt)"
+          f"  {loop / max(padded, 1e-12):.1f}x")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--files", default="data/dev.jsonl,data/train.jsonl")
+    ap.add_argument("--max_length", type=int, default=128)
+    ap.add_argument("--with_model", action="store_true",
+                    help="also diff on the model's own predictions (needs weights in --model_dir)")
+    ap.add_argument("--check", action="store_true",
+                    help="only diff the decoders, without timing; exits non-zero on a mismatch")
+    ap.add_argument("--noise", type=float, default=0.3)
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    tokenizer = AutoTokenizer.from_pretrained(args.model_dir)
+    model = load_model(args.model_dir)[1] if args.with_model else None
+
+    ok = True
+    all_rows, all_offsets, all_texts = [], [], []
+    for path in args.files.split(","):
+        ds = PIIDataset(path, tokenizer, LABELS, max_length=args.max_length, is_train=False)
+        texts = [x["text"] for x in ds.items]
+        offsets = [x["offset_mapping"] for x in ds.items]
+        gold = [x["labels"] for x in ds.items]
+
+        ok &= check(f"{path} gold", gold, offsets, texts)
+        noisy = [corrupt(g, rng, args.noise) for g in gold]
+        ok &= check(f"{path} noisy", noisy, offsets, texts)
+        clean = [[lid if 0 <= lid < len(LABELS) else 0 for lid in r] for r in noisy]
+        if model is not None:
+            enc = {"input_ids": [x["input_ids"] for x in ds.items],
+                   "attention_mask": [x["attention_mask"] for x in ds.items]}
+            pred = forward_sorted(enc, tokenizer, model)
+            ok &= check(f"{path} model", pred, offsets, texts)
+            clean = pred
+
+        all_rows += clean
+        all_offsets += offsets
+        all_texts += texts
+
+    if not args.check:
+        bench(all_rows, all_offsets, all_texts, args.repeat)
+    if not ok:
+        raise SystemExit("batch decoder disagrees with bio_to_spans")
+    print("batch_bio_to_spans matches bio_to_spans on every row.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import time
+import argparse
+
+import torch
+
+from incremental import IncrementalTagger
+from latency_stats import summarize
+from predict import iter_records, load_model, predict_windowed
+
+
+def calls_from(records, concat):
+    """
+    Joins `concat` consecutive utterances into one longer call turn so the
+    prefix grows well past the incremental window.
+    """
+    texts = [obj["text"] for obj in records]
+    for i in range(0, len(texts), concat):
+        yield " ".join(texts[i:i + concat])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--input", default="data/dev.jsonl")
+    ap.add_argument("--max_length", type=int, default=128)
+    ap.add_argument("--stride", type=int, default=32)
+    ap.add_argument("--context_words", type=int, default=12)
+    ap.add_argument("--concat", type=int, default=4,
+                    help="utterances joined into one replayed call turn")
+    ap.add_argument("--limit", type=int, default=None, help="max call turns to replay")
+    ap.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = ap.parse_args()
+
+    tokenizer, model = load_model(args.model_dir, device=args.device)
+    tagger = IncrementalTagger(tokenizer, model, args.max_length, args.stride,
+                               args.context_words, args.device)
+
+    inc_ms, full_ms = [], []
+    n_events = {"add": 0, "update": 0, "retract": 0}
+    calls = agree = 0
+    for n, call in enumerate(calls_from(iter_records(args.input), args.concat)):
+        if args.limit is not None and n >= args.limit:
+            break
+        tagger.reset()
+        words = call.split(" ")
+        full = []
+        for i, w in enumerate(words):
+            delta = w if i == 0 else " " + w
+
+            t0 = time.perf_counter()
+            events = tagger.update(delta)
+            inc_ms.append((time.perf_counter() - t0) * 1000.0)
+            for ev in events:
+                n_events[ev["type"]] += 1
+
+            prefix = tagger.text
+            t0 = time.perf_counter()
+            full = predict_windowed([prefix], tokenizer, model, args.max_length, args.stride,
+                                    args.device)[0]
+            full_ms.append((time.perf_counter() - t0) * 1000.0)
+
+        calls += 1
+        agree += int(sorted(full) == sorted(tagger.spans))
+
+    inc = summarize(inc_ms)
+    rec = summarize(full_ms)
+    print(f"Replayed {calls} call turns word by word ({len(inc_ms)} updates, "
+          f"{args.concat} utterances per turn)")
+    print(f"{'':18s} {'p50':>8s} {'p95':>8s} {'p99':>8s} {'total s':>9s}")
+    print(f"{'incremental':18s} {inc['p50']:8.2f} {inc['p95']:8.2f} {inc['p99']:8.2f} "
+          f"{sum(inc_ms) / 1000:9.2f}")
+    print(f"{'full recompute':18s} {rec['p50']:8.2f} {rec['p95']:8.2f} {rec['p99']:8.2f} "
+          f"{sum(full_ms) / 1000:9.2f}")
+    print(f"Events: {n_events['add']} add, {n_events['update']} update, {n_events['retract']} retract")
+    print(f"Final spans identical to full recompute: {agree}/{calls} turns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import os
+import csv
+import json
+import time
+import random
+import argparse
+import resource
+
+import torch
+
+from latency_stats import summarize
+from predict import iter_chunks, load_model, predict_batch
+
+FIELDS = ("threads", "batch_size", "seq_len", "utterances", "utt_per_s", "tok_per_s",
+          "batch_p50_ms", "batch_p95_ms", "batch_p99_ms", "batch_max_ms", "peak_rss_mb")
+
+
+def synth_texts(tokenizer, seq_len, n, seed=0):
+    """
+    `n` synthetic utterances from dataset_generator.py that each fill at least
+    `seq_len` tokens, so truncating to `seq_len` gives fixed-length batches.
+    """
+    import dataset_generator as gen
+
+    random.seed(seed)
+    out, cur = [], ""
+    while len(out) < n:
+        cur = f"{cur} {gen.make_record(len(out))['text']}".strip()
+        if len(tokenizer(cur)["input_ids"]) >= seq_len:
+            out.append(cur)
+            cur = ""
+    return out
+
+
+def reset_peak_rss():
+    # Linux: writing 5 to clear_refs resets VmHWM, giving a per-cell peak
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb(reset_ok):
+    if reset_ok:
+        with open("/proc/self/status") as f:
+            return next(int(l.split()[1]) for l in f if l.startswith("VmHWM")) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_cell(texts, tokenizer, model, seq_len, batch_size, device):
+    chunks = list(iter_chunks(texts, batch_size))
+    predict_batch(chunks[0], tokenizer, model, seq_len, device, batch_size)  # warmup
+
+    reset_ok = reset_peak_rss()
+    batch_ms = []
+    start = time.perf_counter()
+    for chunk in chunks:
+        t0 = time.perf_counter()
+        predict_batch(chunk, tokenizer, model, seq_len, device, batch_size)
+        batch_ms.append((time.perf_counter() - t0) * 1000.0)
+    elapsed = time.perf_counter() - start
+
+    enc = tokenizer(texts, truncation=True, max_length=seq_len)
+    n_tokens = sum(len(ids) for ids in enc["input_ids"])
+    lat = summarize(batch_ms)
+    return {
+        "utterances": len(texts),
+        "utt_per_s": len(texts) / elapsed,
+        "tok_per_s": n_tokens / elapsed,
+        "batch_p50_ms": lat["p50"],
+        "batch_p95_ms": lat["p95"],
+        "batch_p99_ms": lat["p99"],
+        "batch_max_ms": lat["max"],
+        "peak_rss_mb": peak_rss_mb(reset_ok),
+    }
+
+
+def best_batch_sizes(rows, max_p95_ms=None):
+    """
+    Highest-utt/s batch size for each (threads, seq_len), among cells within
+    the per-batch p95 budget. Sequence length is the workload, not a knob, so
+    it is never traded off against the others.
+    """
+    best = {}
+    for r in rows:
+        if max_p95_ms is not None and r["batch_p95_ms"] > max_p95_ms:
+            continue
+        key = (r["threads"], r["seq_len"])
+        if key not in best or r["utt_per_s"] > best[key]["utt_per_s"]:
+            best[key] = r
+    return [best[k] for k in sorted(best)]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--model_name", default=None)
+    ap.add_argument("--backend", choices=["torch", "onnxruntime", "fast"], default="torch")
+    ap.add_argument("--onnx_path", default=None)
+    ap.add_argument("--quantized", action="store_true")
+    ap.add_argument("--exit_threshold", type=float, default=None)
+    ap.add_argument("--batch_sizes", default="1,8,32")
+    ap.add_argument("--seq_lens", default="32,64,128", help="padded sequence lengths in tokens")
+    ap.add_argument("--threads", default="1,2,4", help="intra-op thread counts")
+    ap.add_argument("--n_utts", type=int, default=256, help="utterances per cell")
+    ap.add_argument("--max_p95_ms", type=float, default=None,
+                    help="only consider cells whose per-batch p95 fits this budget for the summary")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out_dir", default="bench")
+    ap.add_argument("--device", default=None,
+                    help="default: cuda when available, cpu for --backend fast")
+    args = ap.parse_args()
+    if args.device is None:
+        args.device = "cuda" if torch.cuda.is_available() and args.backend != "fast" else "cpu"
+
+    if args.quantized and args.backend == "torch":
+        args.device = "cpu"
+    load_kwargs = dict(model_name=args.model_name, device=args.device, backend=args.backend,
+                       onnx_path=args.onnx_path, quantized=args.quantized,
+                       exit_threshold=args.exit_threshold)
+    tokenizer, model = load_model(args.model_dir, **load_kwargs)
+
+    batch_sizes = [int(x) for x in args.batch_sizes.split(",")]
+    seq_lens = [int(x) for x in args.seq_lens.split(",")]
+    texts = {L: synth_texts(tokenizer, L, args.n_utts, args.seed) for L in seq_lens}
+
+    rows = []
+    print(f"{'threads':>7} {'batch':>5} {'seq':>4} {'utt/s':>8} {'tok/s':>9} {'p50 ms':>8} "
+          f"{'p95 ms':>8} {'p99 ms':>8} {'RSS MB':>7}")
+    for n_threads in [int(x) for x in args.threads.split(",")]:
+        torch.set_num_threads(n_threads)
+        if args.backend == "onnxruntime":
+            # ORT sizes its thread pool when the session is created
+            tokenizer, model = load_model(args.model_dir, num_threads=n_threads, **load_kwargs)
+        for seq_len in seq_lens:
+            for batch_size in batch_sizes:
+                r = {"threads": n_threads, "batch_size": batch_size, "seq_len": seq_len,
+                     **run_cell(texts[seq_len], tokenizer, model, seq_len, batch_size, args.device)}
+                rows.append(r)
+                print(f"{n_threads:7d} {batch_size:5d} {seq_len:4d} {r['utt_per_s']:8.1f} "
+                      f"{r['tok_per_s']:9.0f} {r['batch_p50_ms']:8.2f} {r['batch_p95_ms']:8.2f} "
+                      f"{r['batch_p99_ms']:8.2f} {r['peak_rss_mb']:7.0f}")
+
+    best = best_batch_sizes(rows, args.max_p95_ms)
+    budget = f" with batch p95 <= {args.max_p95_ms:g} ms" if args.max_p95_ms is not None else ""
+    print(f"\nBest batch size per core count and sequence length{budget}:")
+    for r in best:
+        print(f"  threads={r['threads']} seq_len={r['seq_len']}: batch_size={r['batch_size']} "
+              f"-> {r['utt_per_s']:.1f} utt/s, batch p95 {r['batch_p95_ms']:.2f} ms")
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    csv_path = os.path.join(args.out_dir, "throughput.csv")
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    json_path = os.path.join(args.out_dir, "throughput.json")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "model_dir": args.model_dir,
+            "backend": args.backend,
+            "quantized": args.quantized,
+            "device": args.device,
+            "torch": torch.__version__,
+            "max_p95_ms": args.max_p95_ms,
+            "results": rows,
+            "best_batch_sizes": best,
+        }, f, indent=2)
+    print(f"Wrote {csv_path} and {json_path}")
+
+
+if __name__ == "__main__":
+    main()
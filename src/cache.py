@@ -0,0 +1,145 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+# files whose change means cached predictions are stale
+CHECKPOINT_FILES = (
+    "config.json",
+    "model.safetensors",
+    "pytorch_model.bin",
+    "model_int8.pt",
+    "model.onnx",
+    "model.int8.onnx",
+    "model.ts",
+    "weights.pt",
+    "tokenizer.json",
+    "vocab.txt",
+)
+
+
+def checkpoint_fingerprint(model_dir, *extra):
+    """
+    Hash of the checkpoint files' names, sizes and mtimes plus anything else
+    that changes predictions (backend, max_length, ...).
+    """
+    parts = [list(map(str, extra))]
+    for name in CHECKPOINT_FILES:
+        path = os.path.join(model_dir, name)
+        if os.path.exists(path):
+            st = os.stat(path)
+            parts.append([name, st.st_size, st.st_mtime_ns])
+    return hashlib.sha1(json.dumps(parts).encode("utf-8")).hexdigest()
+
+
+def fingerprint_for(model_dir, *, fold_case, max_length, model_name=None, backend="torch",
+                    onnx_path=None, quantized=False, stride=None, exit_threshold=None):
+    """
+    `checkpoint_fingerprint` over every inference setting, in one fixed order,
+    so predict.py and serve.py agree on it and can share a --cache_file.
+    """
+    return checkpoint_fingerprint(model_dir, model_name, backend, onnx_path, quantized,
+                                  max_length, stride, exit_threshold, fold_case)
+
+
+def _normalizer_lowercases(normalizer):
+    if not normalizer:
+        return False
+    if normalizer.get("type") == "Lowercase" or normalizer.get("lowercase"):
+        return True
+    return any(_normalizer_lowercases(n) for n in normalizer.get("normalizers") or ())
+
+
+def tokenizer_lowercases(tokenizer):
+    """
+    Whether the tokenizer folds case before tokenizing, read from its backend
+    normalizer when it has one and from `do_lower_case` otherwise.
+    """
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        return _normalizer_lowercases(json.loads(backend.to_str()).get("normalizer"))
+    return bool(getattr(tokenizer, "do_lower_case", False))
+
+
+def normalize_text(text, fold_case=False):
+    # with an uncased tokenizer case never changes predictions; only fold it
+    # when that keeps every character offset the same
+    if not fold_case:
+        return text
+    lowered = text.lower()
+    return lowered if len(lowered) == len(text) else text
+
+
+class PredictionCache:
+    """
+    Size-bounded LRU cache of spans keyed on a hash of the normalized text;
+    case is folded only when `fold_case` (see `tokenizer_lowercases`).
+    Thread-safe, so the server's request threads and scheduler can share it.
+    """
+
+    def __init__(self, max_entries, fingerprint, path=None, fold_case=False):
+        self.max_entries = max_entries
+        self.fingerprint = fingerprint
+        self.fold_case = fold_case
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if path is not None:
+            self.load(path)
+
+    def key(self, text):
+        return hashlib.sha1(normalize_text(text, self.fold_case).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            spans = self.entries.get(key)
+            if spans is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return spans
+
+    def put(self, key, spans):
+        with self._lock:
+            self.entries[key] = spans
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def load(self, path):
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            obj = json.load(f)
+        if obj.get("fingerprint") != self.fingerprint:
+            print(f"Ignoring {path}: model checkpoint changed since it was written")
+            return
+        for key, spans in obj["entries"][-self.max_entries:]:
+            self.entries[key] = [tuple(s) for s in spans]
+
+    def save(self, path=None):
+        path = path or self.path
+        with self._lock:
+            obj = {"fingerprint": self.fingerprint, "entries": list(self.entries.items())}
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False)
+        os.replace(tmp, path)
@@ -1,99 +1,312 @@
+import os
 import json
+import shutil
+import hashlib
+import tempfile
 from typing import List, Dict, Any
-from torch.utils.data import Dataset
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset, Sampler
+
+CACHE_VERSION = 1
+TOKENIZE_BATCH = 1000
+
+# flat on-disk columns: name -> dtype (row boundaries live in the *_starts files)
+COLUMNS = {
+    "input_ids": np.int32,
+    "labels": np.int16,
+    "offsets": np.int32,
+    "token_starts": np.int64,
+    "text": np.uint8,
+    "text_starts": np.int64,
+    "id": np.uint8,
+    "id_starts": np.int64,
+}
+
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def tokenizer_hash(tokenizer):
+    # the backend JSON also carries the truncation/padding state of the last
+    # call, which says nothing about the vocabulary; leave it out of the key
+    spec = json.loads(tokenizer.backend_tokenizer.to_str())
+    spec.pop("truncation", None)
+    spec.pop("padding", None)
+    return hashlib.sha1(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def align_labels(offsets, entities, text_len, label2id):
+    """
+    BIO label id per token from entity character intervals. A token gets the
+    label of the character it starts on: B- if that is the entity's first
+    character, I- otherwise. Later entities win where entities overlap, and
+    special tokens (empty offsets) are O.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64).reshape(-1, 2)
+    starts, ends = offsets[:, 0], offsets[:, 1]
+    real = starts != ends
+    labels = np.full(len(offsets), label2id["O"], dtype=np.int16)
+    for e in entities:
+        s, e_idx, lab = e["start"], e["end"], e["label"]
+        if s < 0 or e_idx > text_len or s >= e_idx:
+            continue
+        inside = real & (starts >= s) & (starts < e_idx)
+        labels[inside] = label2id.get(f"I-{lab}", label2id["O"])
+        labels[inside & (starts == s)] = label2id.get(f"B-{lab}", label2id["O"])
+    return labels
+
+
+class _Items:
+    """Read-only list view over the dataset rows (kept for `ds.items` callers)."""
+
+    def __init__(self, ds):
+        self.ds = ds
+
+    def __len__(self):
+        return len(self.ds)
+
+    def __getitem__(self, idx):
+        return self.ds[idx]
+
+    def __iter__(self):
+        return (self.ds[i] for i in range(len(self.ds)))
 
 
 class PIIDataset(Dataset):
-    def __init__(self, path: str, tokenizer, label_list: List[str], max_length: int = 256, is_train: bool = True):
-        self.items = []
+    """
+    Tokenized utterances with BIO labels, stored as flat int arrays. The whole
+    file is tokenized in batches; with `cache_dir` set, the arrays are written
+    there once (keyed by tokenizer, `max_length` and file contents) and later
+    runs memory-map them instead of re-tokenizing, so corpora larger than RAM
+    are read from disk on demand.
+    """
+
+    def __init__(self, path: str, tokenizer, label_list: List[str], max_length: int = 256,
+                 is_train: bool = True, cache_dir: str = None):
         self.tokenizer = tokenizer
         self.label_list = label_list
         self.label2id = {l: i for i, l in enumerate(label_list)}
         self.max_length = max_length
         self.is_train = is_train
 
-        with open(path, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                obj = json.loads(line)
-                text = obj["text"]
-                entities = obj.get("entities", [])
-
-                char_tags = ["O"] * len(text)
-                for e in entities:
-                    s, e_idx, lab = e["start"], e["end"], e["label"]
-                    if s < 0 or e_idx > len(text) or s >= e_idx:
+        if cache_dir is None:
+            with tempfile.TemporaryDirectory() as tmp:
+                self._build(path, tmp)
+                self._load(tmp, mmap=False)
+        else:
+            key = hashlib.sha1(json.dumps([
+                CACHE_VERSION, tokenizer_hash(tokenizer), max_length, label_list, file_hash(path),
+            ]).encode("utf-8")).hexdigest()[:16]
+            self.cache_path = os.path.join(cache_dir, f"{os.path.basename(path)}.{key}")
+            if not os.path.exists(os.path.join(self.cache_path, "meta.json")):
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp = tempfile.mkdtemp(dir=cache_dir)
+                try:
+                    self._build(path, tmp)
+                    os.replace(tmp, self.cache_path)
+                except OSError:
+                    shutil.rmtree(tmp, ignore_errors=True)
+                    # another process finished the same cache first
+                    if not os.path.exists(os.path.join(self.cache_path, "meta.json")):
+                        raise
+            self._load(self.cache_path, mmap=True)
+        self.items = _Items(self)
+
+    def _build(self, path, out_dir):
+        files = {name: open(os.path.join(out_dir, f"{name}.bin"), "wb") for name in COLUMNS}
+        n_rows = n_tokens = n_text = n_id = 0
+        try:
+            for name in ("token_starts", "text_starts", "id_starts"):
+                np.zeros(1, dtype=COLUMNS[name]).tofile(files[name])
+
+            def flush(batch):
+                nonlocal n_rows, n_tokens, n_text, n_id
+                enc = self.tokenizer([obj["text"] for obj in batch], return_offsets_mapping=True,
+                                     truncation=True, max_length=self.max_length,
+                                     add_special_tokens=True)
+                for obj, ids, offsets in zip(batch, enc["input_ids"], enc["offset_mapping"]):
+                    labels = align_labels(offsets, obj.get("entities", []), len(obj["text"]),
+                                          self.label2id)
+                    text = obj["text"].encode("utf-8")
+                    uid = str(obj["id"]).encode("utf-8")
+                    n_tokens += len(ids)
+                    n_text += len(text)
+                    n_id += len(uid)
+                    np.asarray(ids, dtype=COLUMNS["input_ids"]).tofile(files["input_ids"])
+                    labels.tofile(files["labels"])
+                    np.asarray(offsets, dtype=COLUMNS["offsets"]).reshape(-1, 2).tofile(files["offsets"])
+                    files["text"].write(text)
+                    files["id"].write(uid)
+                    np.asarray([n_tokens], dtype=np.int64).tofile(files["token_starts"])
+                    np.asarray([n_text], dtype=np.int64).tofile(files["text_starts"])
+                    np.asarray([n_id], dtype=np.int64).tofile(files["id_starts"])
+                n_rows += len(batch)
+
+            batch = []
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
                         continue
-                    char_tags[s] = f"B-{lab}"
-                    for i in range(s + 1, e_idx):
-                        char_tags[i] = f"I-{lab}"
-
-                enc = tokenizer(
-                    text,
-                    return_offsets_mapping=True,
-                    truncation=True,
-                    max_length=self.max_length,
-                    add_special_tokens=True,
-                )
-                offsets = enc["offset_mapping"]
-                input_ids = enc["input_ids"]
-                attention_mask = enc["attention_mask"]
-
-                bio_tags = []
-                for (start, end) in offsets:
-                    if start == end:
-                        bio_tags.append("O")
-                    else:
-                        if start < len(char_tags):
-                            bio_tags.append(char_tags[start])
-                        else:
-                            bio_tags.append("O")
-
-                if len(bio_tags) != len(input_ids):
-                    bio_tags = ["O"] * len(input_ids)
-
-                label_ids = [self.label2id.get(t, self.label2id["O"]) for t in bio_tags]
-
-                self.items.append(
-                    {
-                        "id": obj["id"],
-                        "text": text,
-                        "input_ids": input_ids,
-                        "attention_mask": attention_mask,
-                        "labels": label_ids,
-                        "offset_mapping": offsets,
-                    }
-                )
+                    batch.append(json.loads(line))
+                    if len(batch) >= TOKENIZE_BATCH:
+                        flush(batch)
+                        batch = []
+            if batch:
+                flush(batch)
+        finally:
+            for f in files.values():
+                f.close()
+
+        with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": CACHE_VERSION, "rows": n_rows, "tokens": n_tokens,
+                       "max_length": self.max_length, "source": os.path.abspath(path)}, f)
+
+    def _load(self, cache_path, mmap=True):
+        with open(os.path.join(cache_path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        cols = {}
+        for name, dtype in COLUMNS.items():
+            file = os.path.join(cache_path, f"{name}.bin")
+            if os.path.getsize(file) == 0:
+                cols[name] = np.zeros(0, dtype=dtype)
+            elif mmap:
+                cols[name] = np.memmap(file, dtype=dtype, mode="r")
+            else:
+                cols[name] = np.fromfile(file, dtype=dtype)
+        cols["offsets"] = cols["offsets"].reshape(-1, 2)
+        self.cols = cols
+        self.lengths = np.diff(cols["token_starts"])
 
     def __len__(self) -> int:
-        return len(self.items)
+        return self.meta["rows"]
 
     def __getitem__(self, idx: int) -> Dict[str, Any]:
-        return self.items[idx]
+        c = self.cols
+        a, b = int(c["token_starts"][idx]), int(c["token_starts"][idx + 1])
+        ta, tb = int(c["text_starts"][idx]), int(c["text_starts"][idx + 1])
+        ia, ib = int(c["id_starts"][idx]), int(c["id_starts"][idx + 1])
+        return {
+            "id": c["id"][ia:ib].tobytes().decode("utf-8"),
+            "text": c["text"][ta:tb].tobytes().decode("utf-8"),
+            "input_ids": c["input_ids"][a:b].tolist(),
+            "attention_mask": [1] * (b - a),
+            "labels": c["labels"][a:b].tolist(),
+            "offset_mapping": [tuple(o) for o in c["offsets"][a:b].tolist()],
+        }
+
+    def padded_batch(self, indices, pad_token_id: int, label_pad_id: int = -100,
+                     offsets: bool = False):
+        """
+        input_ids / attention_mask / labels tensors for `indices`, padded to the
+        longest row and filled straight from the flat arrays. With `offsets`,
+        also an [B, T, 2] `offset_mapping` with (0, 0) at padding.
+        """
+        starts, lengths = self.cols["token_starts"][indices], self.lengths[indices]
+        width = int(lengths.max())
+        input_ids = np.full((len(indices), width), pad_token_id, dtype=np.int64)
+        labels = np.full((len(indices), width), label_pad_id, dtype=np.int64)
+        for row, (a, n) in enumerate(zip(starts.tolist(), lengths.tolist())):
+            input_ids[row, :n] = self.cols["input_ids"][a:a + n]
+            labels[row, :n] = self.cols["labels"][a:a + n]
+        attention_mask = (np.arange(width)[None, :] < lengths[:, None]).astype(np.int64)
+        out = {
+            "input_ids": torch.from_numpy(input_ids),
+            "attention_mask": torch.from_numpy(attention_mask),
+            "labels": torch.from_numpy(labels),
+        }
+        if offsets:
+            offs = np.zeros((len(indices), width, 2), dtype=np.int64)
+            for row, (a, n) in enumerate(zip(starts.tolist(), lengths.tolist())):
+                offs[row, :n] = self.cols["offsets"][a:a + n]
+            out["offset_mapping"] = torch.from_numpy(offs)
+        return out
+
+
+class _PaddedBatches(Dataset):
+    """Indexed by a list of row indices (from a batch sampler); returns the padded batch."""
+
+    def __init__(self, ds, pad_token_id, label_pad_id=-100):
+        self.ds = ds
+        self.pad_token_id = pad_token_id
+        self.label_pad_id = label_pad_id
+
+    def __len__(self):
+        return len(self.ds)
+
+    def __getitem__(self, indices):
+        return self.ds.padded_batch(indices, self.pad_token_id, self.label_pad_id)
+
+
+class LengthBucketSampler(Sampler):
+    """
+    Random batches of similar-length rows. Each epoch the rows are shuffled,
+    cut into windows of `bucket_size` rows, and each window is sorted by
+    length and split into batches of `batch_size` rows, or, with
+    `max_tokens`, of as many rows as fit in `max_tokens` padded tokens. The
+    batch order is shuffled again. `bucket_size=0` skips the sorting (plain
+    uniform shuffling).
+    """
+
+    def __init__(self, lengths, batch_size=8, max_tokens=None, bucket_size=None, seed=0):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.bucket_size = 100 * batch_size if bucket_size is None else bucket_size
+        self.seed = seed
+        self.epoch = 0
+        self._batches = self._plan(self.epoch)
+
+    def _split(self, rows):
+        if self.max_tokens is None:
+            return [rows[i:i + self.batch_size] for i in range(0, len(rows), self.batch_size)]
+        batches, cur, width = [], [], 0
+        for i in rows:
+            w = max(width, int(self.lengths[i]))
+            if cur and w * (len(cur) + 1) > self.max_tokens:
+                batches.append(cur)
+                cur, w = [], int(self.lengths[i])
+            cur.append(i)
+            width = w
+        if cur:
+            batches.append(cur)
+        return batches
 
+    def _plan(self, epoch):
+        rng = np.random.default_rng((self.seed, epoch))
+        order = rng.permutation(len(self.lengths))
+        if self.bucket_size <= 0:
+            return self._split(order.tolist())
+        batches = []
+        for i in range(0, len(order), self.bucket_size):
+            window = order[i:i + self.bucket_size]
+            window = window[np.argsort(self.lengths[window], kind="stable")]
+            batches.extend(self._split(window.tolist()))
+        return [batches[j] for j in rng.permutation(len(batches))]
 
-def collate_batch(batch, pad_token_id: int, label_pad_id: int = -100):
-    input_ids_list = [x["input_ids"] for x in batch]
-    attention_list = [x["attention_mask"] for x in batch]
-    labels_list = [x["labels"] for x in batch]
+    def __iter__(self):
+        batches = self._batches
+        self.epoch += 1
+        self._batches = self._plan(self.epoch)
+        return iter(batches)
 
-    max_len = max(len(ids) for ids in input_ids_list)
+    def __len__(self):
+        # the count for the coming epoch; with max_tokens it can vary slightly between epochs
+        return len(self._batches)
 
-    def pad(seq, pad_value, max_len):
-        return seq + [pad_value] * (max_len - len(seq))
 
-    input_ids = [pad(ids, pad_token_id, max_len) for ids in input_ids_list]
-    attention_mask = [pad(am, 0, max_len) for am in attention_list]
-    labels = [pad(lab, label_pad_id, max_len) for lab in labels_list]
+def make_loader(ds, pad_token_id, batch_size=8, max_tokens=None, bucket_size=None,
+                num_workers=0, prefetch_factor=2, pin_memory=False, seed=0):
+    """Length-bucketed DataLoader over `ds` yielding padded tensor batches."""
+    sampler = LengthBucketSampler(ds.lengths, batch_size, max_tokens, bucket_size, seed)
+    extra = dict(prefetch_factor=prefetch_factor, persistent_workers=True) if num_workers > 0 else {}
+    return DataLoader(_PaddedBatches(ds, pad_token_id), sampler=sampler, batch_size=None,
+                      num_workers=num_workers, pin_memory=pin_memory, **extra)
 
-    out = {
-        "input_ids": input_ids,
-        "attention_mask": attention_mask,
-        "labels": labels,
-        "ids": [x["id"] for x in batch],
-        "texts": [x["text"] for x in batch],
-        "offset_mapping": [x["offset_mapping"] for x in batch],
-    }
-    return out
@@ -1,14 +1,20 @@
+import os
 import json
+import time
 import random
 import re
+import argparse
+import multiprocessing as mp
 
 NUM_TRAIN = 500
 NUM_DEV = 150
 
 OUTPUT_TRAIN_FILE = "generated_train.jsonl"
 OUTPUT_DEV_FILE = "generated_dev.jsonl"
+SHARD_SIZE = 100_000
+SEED = 42
 
-random.seed(42)
+random.seed(SEED)
 
 DIGIT_WORD = {
     "0": "zero",
@@ -393,119 +399,188 @@ COMPLEX_TEMPLATES = [
 TEMPLATES = SIMPLE_TEMPLATES + MEDIUM_TEMPLATES + COMPLEX_TEMPLATES
 
 
-def inject_sentence_noise(text: str) -> str:
+# ASR-style mishears: whole words that get replaced (only between two other
+# words), and substrings of words that get respelled as separate words
+# ("john@gmail.com" -> "john@ gee mail .com")
+WORD_MISHEARS = [("dot", "daht"), ("at", "aet"), ("zero", "oh")]
+SUBWORD_MISHEARS = [("gmail", "gee mail"), ("underscore", "under score")]
+
+
+def inject_sentence_noise(words, rng=random):
     """
     Apply light ASR-style noise occasionally: fillers, small mishears.
+    `words` is a list of (word, tag) pairs; every word keeps the tag of the
+    word it came from, so entity boundaries move with the edits.
     """
     # fillers
-    if random.random() < 0.2:
-        text = "uh " + text
-    if random.random() < 0.1:
-        text = "okay " + text
+    if rng.random() < 0.2:
+        words = [("uh", None)] + words
+    if rng.random() < 0.1:
+        words = [("okay", None)] + words
 
     # mishear-like replacements
-    replacements = [
-        (" dot ", " daht "),
-        (" at ", " aet "),
-        (" zero ", " oh "),
-        ("gmail", "gee mail"),
-        ("underscore", "under score"),
-    ]
-    for old, new in replacements:
-        if random.random() < 0.2:
-            text = text.replace(old, " " + new + " ")
-
-    # collapse double spaces
-    text = re.sub(r"\s+", " ", text).strip()
-    return text
+    for old, new in WORD_MISHEARS:
+        if rng.random() < 0.2:
+            # like str.replace(" dot ", ...): of two adjacent matches only the first is hit
+            out, hit = [], False
+            for i, (w, tag) in enumerate(words):
+                hit = w == old and 0 < i < len(words) - 1 and not hit
+                out.append((new if hit else w, tag))
+            words = out
+    for old, new in SUBWORD_MISHEARS:
+        if rng.random() < 0.2:
+            words = [(part, tag) for w, tag in words
+                     for part in w.replace(old, f" {new} ").split()]
+    return words
 
 
 PLACEHOLDER_PATTERN = re.compile(r"\{([A-Z_]+)\}")
 
-def fill_template(template: str):
+def fill_template(template: str, rng=random):
     """
     Given a template with placeholders like {EMAIL}, {PHONE},
     return (text, entities_list) where entities_list has (start, end, label).
+    Offsets are tracked through the noise, so a value that occurs twice keeps
+    its own span and no entity is lost.
     """
-    text = template
-    entities = []
-
-    # Find placeholders in order
-    matches = list(PLACEHOLDER_PATTERN.finditer(template))
-    # we'll build the text gradually
-    offset = 0
-    result_parts = []
+    words = []  # (word, index into `labels` or None)
+    labels = []
     last_idx = 0
-
-    for m in matches:
-        label = m.group(1)
-        start_tmpl, end_tmpl = m.span()
-        # add static part
-        static_chunk = template[last_idx:start_tmpl]
-        result_parts.append(static_chunk)
-        offset += len(static_chunk)
-
+    for m in PLACEHOLDER_PATTERN.finditer(template):
+        words.extend((w, None) for w in template[last_idx:m.start()].split())
         # pick a random value for this label
-        value = random.choice(ENTITY_VALUES[label])
-        value_text = value
-
-        # entity span in final text
-        ent_start = offset
-        ent_end = ent_start + len(value_text)
-        entities.append({"start": ent_start, "end": ent_end, "label": label})
-
-        result_parts.append(value_text)
-        offset = ent_end
-        last_idx = end_tmpl
-
-    # add remaining static tail
-    result_parts.append(template[last_idx:])
-    text = "".join(result_parts)
-    text = re.sub(r"\s+", " ", text).strip()
-
-    # adjust entity offsets if we apply noise later
-    noisy_text = inject_sentence_noise(text)
-
-    if noisy_text != text:
-        # need to recompute offsets based on actual substrings
-        updated_entities = []
-        for ent in entities:
-            span_text = text[ent["start"]:ent["end"]]
-            # find first occurrence of that span in noisy_text
-            new_start = noisy_text.find(span_text)
-            if new_start == -1:
-                # fallback: skip if cannot find (rare with mild noise)
-                continue
-            new_end = new_start + len(span_text)
-            updated_entities.append({
-                "start": new_start,
-                "end": new_end,
-                "label": ent["label"]
-            })
-        entities = updated_entities
-    text = noisy_text
+        value = rng.choice(ENTITY_VALUES[m.group(1)])
+        words.extend((w, len(labels)) for w in value.split())
+        labels.append(m.group(1))
+        last_idx = m.end()
+    words.extend((w, None) for w in template[last_idx:].split())
+
+    words = inject_sentence_noise(words, rng)
 
+    spans = {}
+    offset = 0
+    for w, tag in words:
+        if tag is not None:
+            start, _ = spans.get(tag, (offset, None))
+            spans[tag] = (start, offset + len(w))
+        offset += len(w) + 1
+    text = " ".join(w for w, _ in words)
+    entities = [{"start": spans[k][0], "end": spans[k][1], "label": labels[k]} for k in sorted(spans)]
     return text, entities
 
 
-def make_record(idx: int):
-    template = random.choice(TEMPLATES)
-    text, entities = fill_template(template)
+def make_record(idx: int, rng=random):
+    template = rng.choice(TEMPLATES)
+    text, entities = fill_template(template, rng)
     return {
         "id": f"utt_{idx:04d}",
         "text": text,
         "entities": entities
     }
 
-def write_dataset(path: str, count: int):
+def write_dataset(path: str, count: int, rng=random):
     with open(path, "w", encoding="utf-8") as f:
         for i in range(count):
-            rec = make_record(i)
+            rec = make_record(i, rng)
             f.write(json.dumps(rec, ensure_ascii=False) + "\n")
     print(f"wrote {count} examples to {path}")
 
 
-if __name__ == "__main__":
-    write_dataset(OUTPUT_TRAIN_FILE, NUM_TRAIN)
-    write_dataset(OUTPUT_DEV_FILE, NUM_DEV)
+def shard_path(prefix, shard, n_shards):
+    if n_shards == 1:
+        return prefix
+    root, ext = os.path.splitext(prefix)
+    return f"{root}-{shard:05d}-of-{n_shards:05d}{ext or '.jsonl'}"
+
+
+def write_shard(task):
+    """
+    Writes records [start, stop) of one split to `path`. The shard's RNG is
+    seeded from (seed, split, shard index) alone, so the output does not
+    depend on how many workers there are or which one runs the shard.
+    """
+    path, split, seed, shard, start, stop = task
+    rng = random.Random(f"{seed}:{split}:{shard}")
+    with open(path, "w", encoding="utf-8", buffering=1 << 20) as f:
+        for i in range(start, stop):
+            f.write(json.dumps(make_record(i, rng), ensure_ascii=False) + "\n")
+    return path, stop - start
+
+
+def generate(prefix, split, count, seed=SEED, workers=1, shard_size=SHARD_SIZE):
+    """
+    `count` records of `split` as JSONL shards of `shard_size` records named
+    after `prefix`, generated by `workers` processes. Returns (paths, seconds).
+    """
+    n_shards = max(1, -(-count // shard_size))
+    tasks = [(shard_path(prefix, k, n_shards), split, seed, k, k * shard_size,
+              min(count, (k + 1) * shard_size)) for k in range(n_shards)]
+    start = time.perf_counter()
+    if workers <= 1:
+        done = [write_shard(t) for t in tasks]
+    else:
+        with mp.get_context("spawn").Pool(min(workers, n_shards)) as pool:
+            done = pool.map(write_shard, tasks, chunksize=1)
+    return [path for path, _ in done], time.perf_counter() - start
+
+
+def scaling_table(count, grid, seed=SEED, shard_size=SHARD_SIZE, out_dir="."):
+    """records/s per worker count, checking that every run writes the same bytes."""
+    print(f"{'workers':>7} {'records/s':>10} {'speedup':>8}")
+    base = reference = None
+    for workers in grid:
+        prefix = os.path.join(out_dir, f"scaling_{workers}.jsonl")
+        paths, elapsed = generate(prefix, "train", count, seed, workers, shard_size)
+        data = b"".join(open(p, "rb").read() for p in paths)
+        for p in paths:
+            os.remove(p)
+        reference = reference if reference is not None else data
+        rate = count / max(elapsed, 1e-9)
+        base = base or rate
+        same = "" if data == reference else "  OUTPUT DIFFERS"
+        print(f"{workers:7d} {rate:10.0f} {rate / base:7.2f}x{same}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--train", type=int, default=NUM_TRAIN, help="train records")
+    ap.add_argument("--dev", type=int, default=NUM_DEV, help="dev records")
+    ap.add_argument("--out_dir", default=".")
+    ap.add_argument("--seed", type=int, default=SEED)
+    ap.add_argument("--workers", type=int, default=os.cpu_count())
+    ap.add_argument("--shard_size", type=int, default=SHARD_SIZE, help="records per output file")
+    ap.add_argument("--scaling", default=None,
+                    help="comma-separated worker counts: time --train records per count instead")
+    args = ap.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    if args.scaling:
+        scaling_table(args.train, [int(w) for w in args.scaling.split(",")], args.seed,
+                      args.shard_size, args.out_dir)
+        return
+
+    splits = (("train", OUTPUT_TRAIN_FILE, args.train), ("dev", OUTPUT_DEV_FILE, args.dev))
+    if max(args.train, args.dev) <= args.shard_size:
+        # one file per split: train then dev from a single stream, as the
+        # single-process generator always did. With the default seed that is
+        # the module RNG continuing after the entity values were drawn from it,
+        # so the default files stay byte-identical.
+        rng = random if args.seed == SEED else random.Random(args.seed)
+        for _, prefix, count in splits:
+            write_dataset(os.path.join(args.out_dir, prefix), count, rng)
+        print("done.")
+        return
+
+    for split, prefix, count in splits:
+        if count <= 0:
+            continue
+        paths, elapsed = generate(os.path.join(args.out_dir, prefix), split, count, args.seed,
+                                  args.workers, args.shard_size)
+        print(f"wrote {count} {split} examples to {len(paths)} shard(s) "
+              f"({paths[0]}{' ...' if len(paths) > 1 else ''}) in {elapsed:.1f}s, "
+              f"{count / max(elapsed, 1e-9):.0f} records/s")
     print("done.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+from itertools import chain
+
+import numpy as np
+
+from labels import LABELS
+
+# per label id: 0 = O, 1 = B, 2 = I, and the index of its entity type
+ENTITY_TYPES = sorted({l.split("-", 1)[1] for l in LABELS if l != "O"})
+PREFIX = np.array([0 if l == "O" else (1 if l.startswith("B-") else 2) for l in LABELS], dtype=np.int8)
+TYPE = np.array([-1 if l == "O" else ENTITY_TYPES.index(l.split("-", 1)[1]) for l in LABELS],
+                dtype=np.int16)
+
+
+def _flatten(label_ids, offsets):
+    """
+    Accepts either padded arrays ([B, T] ids, [B, T, 2] offsets) or ragged
+    per-row lists. Returns flat ids, starts, ends and row numbers.
+    """
+    if isinstance(label_ids, np.ndarray) and label_ids.ndim == 2:
+        offsets = np.asarray(offsets)
+        rows = np.repeat(np.arange(label_ids.shape[0]), label_ids.shape[1])
+        return label_ids.reshape(-1), offsets[..., 0].reshape(-1), offsets[..., 1].reshape(-1), rows, \
+            label_ids.shape[0]
+
+    n_rows = len(label_ids)
+    lengths = np.fromiter((len(r) for r in label_ids), dtype=np.int64, count=n_rows)
+    total = int(lengths.sum())
+    if n_rows and isinstance(label_ids[0], np.ndarray):
+        ids = np.concatenate(label_ids) if total else np.zeros(0, dtype=np.int64)
+    else:
+        ids = np.fromiter(chain.from_iterable(label_ids), dtype=np.int64, count=total)
+    offs = np.fromiter(chain.from_iterable(chain.from_iterable(offsets)), dtype=np.int64,
+                       count=2 * total).reshape(-1, 2)
+    rows = np.repeat(np.arange(n_rows), lengths)
+    return ids, offs[:, 0], offs[:, 1], rows, n_rows
+
+
+def batch_bio_to_spans(label_ids, offsets):
+    """
+    Array version of `predict.bio_to_spans` for a whole batch. Produces exactly
+    the same spans per row: tokens with offset (0, 0) are skipped without
+    closing a span, O closes the current span, B always opens a new one, and I
+    extends the current span only when it has the same entity type (otherwise
+    it opens a new one). Unknown label ids count as O.
+    """
+    ids, starts, ends, rows, n_rows = _flatten(label_ids, offsets)
+
+    keep = ~((starts == 0) & (ends == 0))
+    ids, starts, ends, rows = ids[keep], starts[keep], ends[keep], rows[keep]
+
+    known = (ids >= 0) & (ids < len(LABELS))
+    safe = np.where(known, ids, 0)
+    prefix = np.where(known, PREFIX[safe], 0)
+    etype = np.where(known, TYPE[safe], -1)
+
+    ent = prefix != 0
+    # a token continues the previous one when it is I- of the same type, right
+    # after an entity token in the same row
+    cont = np.zeros(len(ids), dtype=bool)
+    if len(ids) > 1:
+        cont[1:] = (
+            (prefix[1:] == 2)
+            & ent[:-1]
+            & (etype[1:] == etype[:-1])
+            & (rows[1:] == rows[:-1])
+        )
+    is_start = ent & ~cont
+    is_last = ent.copy()
+    is_last[:-1] &= ~cont[1:]
+
+    first = np.flatnonzero(is_start)
+    last = np.flatnonzero(is_last)
+
+    out = [[] for _ in range(n_rows)]
+    for r, s, e, t in zip(rows[first].tolist(), starts[first].tolist(), ends[last].tolist(),
+                          etype[first].tolist()):
+        out[r].append((s, e, ENTITY_TYPES[t]))
+    return out
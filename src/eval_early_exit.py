@@ -0,0 +1,56 @@
+import json
+import argparse
+
+from eval_span_f1 import load_gold, compute_metrics
+from latency_stats import summarize
+from predict import iter_records, load_model, predict_timed
+
+
+def run(records, tokenizer, model, max_length):
+    exits = []
+    _, pred, times_ms = predict_timed(records, tokenizer, model, max_length,
+                                      on_forward=lambda: exits.append(model.last_exit_layer))
+    return pred, times_ms, exits
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--dev", default="data/dev.jsonl")
+    ap.add_argument("--max_length", type=int, default=128)
+    ap.add_argument("--thresholds", default="0.5,0.7,0.8,0.9,0.95,0.99,1.01",
+                    help="comma-separated exit thresholds; > 1 never exits early")
+    ap.add_argument("--report", default=None, help="optional JSON report path")
+    args = ap.parse_args()
+
+    tokenizer, model = load_model(args.model_dir, device="cpu")
+    if not hasattr(model, "exit_classifiers"):
+        raise SystemExit(f"{args.model_dir} is not an early-exit checkpoint (train.py --early_exit)")
+    records = list(iter_records(args.dev))
+    gold = load_gold(args.dev)
+
+    model.exit_threshold = 1.01
+    run(records[:5], tokenizer, model, args.max_length)  # warmup
+
+    rows = []
+    print(f"{'threshold':>9} {'avg exit':>8} {'p50 ms':>7} {'p95 ms':>7} {'PII P':>6} {'PII R':>6} "
+          f"{'PII F1':>6} {'Macro-F1':>8}")
+    for t in [float(x) for x in args.thresholds.split(",")]:
+        model.exit_threshold = t
+        pred, times_ms, exits = run(records, tokenizer, model, args.max_length)
+        m = compute_metrics(gold, pred)
+        lat = summarize(times_ms)
+        avg_exit = sum(exits) / len(exits)
+        rows.append({"threshold": t, "avg_exit_layer": avg_exit, "latency_ms": lat, "metrics": m})
+        print(f"{t:9.2f} {avg_exit:8.2f} {lat['p50']:7.2f} {lat['p95']:7.2f} "
+              f"{m['pii']['precision']:6.3f} {m['pii']['recall']:6.3f} {m['pii']['f1']:6.3f} "
+              f"{m['macro_f1']:8.3f}")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+        print(f"Wrote report to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -17,11 +17,43 @@ def load_gold(path):
     return gold
 
 
-def load_pred(path):
+def is_jsonl_pred(path):
+    """
+    Whether a prediction file is the streamed JSONL form, judged from its first
+    non-blank line: a JSONL record is an object with "id" and "entities" keys.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                return False  # the start of a multi-line JSON object
+            return isinstance(rec, dict) and "id" in rec and "entities" in rec
+    return True  # empty: no predictions either way
+
+
+def iter_pred_items(path):
+    """
+    Yields (id, ents) from either the single JSON object written by predict.py
+    or its streamed JSONL form ({"id": ..., "entities": [...]} per line).
+    """
     with open(path, "r", encoding="utf-8") as f:
-        obj = json.load(f)
+        if not is_jsonl_pred(path):
+            yield from json.load(f).items()
+            return
+        for line in f:
+            line = line.strip()
+            if line:
+                rec = json.loads(line)
+                yield rec["id"], rec["entities"]
+
+
+def load_pred(path):
     pred = {}
-    for uid, ents in obj.items():
+    for uid, ents in iter_pred_items(path):
         spans = []
         for e in ents:
             spans.append((e["start"], e["end"], e["label"]))
@@ -36,15 +68,7 @@ def compute_prf(tp, fp, fn):
     return prec, rec, f1
 
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--gold", required=True)
-    ap.add_argument("--pred", required=True)
-    args = ap.parse_args()
-
-    gold = load_gold(args.gold)
-    pred = load_pred(args.pred)
-
+def compute_metrics(gold, pred):
     labels = set()
     for spans in gold.values():
         for _, _, lab in spans:
@@ -67,18 +91,17 @@ def main():
             if span not in p_spans:
                 fn[span[2]] += 1
 
-    print("Per-entity metrics:")
+    per_entity = {}
     macro_f1_sum = 0.0
     macro_count = 0
 
     for lab in sorted(labels):
         p, r, f1 = compute_prf(tp[lab], fp[lab], fn[lab])
-        print(f"{lab:15s} P={p:.3f} R={r:.3f} F1={f1:.3f}")
+        per_entity[lab] = {"precision": p, "recall": r, "f1": f1}
         macro_f1_sum += f1
         macro_count += 1
 
     macro_f1 = macro_f1_sum / max(1, macro_count)
-    print(f"\nMacro-F1: {macro_f1:.3f}")
 
     pii_tp = pii_fp = pii_fn = 0
     non_tp = non_fp = non_fn = 0
@@ -111,9 +134,39 @@ def main():
                 non_fn += 1
 
     p, r, f1 = compute_prf(pii_tp, pii_fp, pii_fn)
-    print(f"\nPII-only metrics: P={p:.3f} R={r:.3f} F1={f1:.3f}")
     p2, r2, f12 = compute_prf(non_tp, non_fp, non_fn)
-    print(f"Non-PII metrics: P={p2:.3f} R={r2:.3f} F1={f12:.3f}")
+
+    return {
+        "per_entity": per_entity,
+        "macro_f1": macro_f1,
+        "pii": {"precision": p, "recall": r, "f1": f1},
+        "non_pii": {"precision": p2, "recall": r2, "f1": f12},
+    }
+
+
+def print_metrics(metrics):
+    print("Per-entity metrics:")
+    for lab, m in metrics["per_entity"].items():
+        print(f"{lab:15s} P={m['precision']:.3f} R={m['recall']:.3f} F1={m['f1']:.3f}")
+
+    print(f"\nMacro-F1: {metrics['macro_f1']:.3f}")
+
+    m = metrics["pii"]
+    print(f"\nPII-only metrics: P={m['precision']:.3f} R={m['recall']:.3f} F1={m['f1']:.3f}")
+    m = metrics["non_pii"]
+    print(f"Non-PII metrics: P={m['precision']:.3f} R={m['recall']:.3f} F1={m['f1']:.3f}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--gold", required=True)
+    ap.add_argument("--pred", required=True)
+    args = ap.parse_args()
+
+    gold = load_gold(args.gold)
+    pred = load_pred(args.pred)
+
+    print_metrics(compute_metrics(gold, pred))
 
 
 if __name__ == "__main__":
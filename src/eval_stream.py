@@ -0,0 +1,280 @@
+import os
+import json
+import time
+import sqlite3
+import argparse
+import tempfile
+import multiprocessing as mp
+from array import array
+from collections import defaultdict
+
+import numpy as np
+
+from eval_span_f1 import (compute_metrics, compute_prf, is_jsonl_pred, iter_pred_items, load_gold,
+                          load_pred, print_metrics)
+from labels import PII_LABELS
+
+
+class _Unsorted(Exception):
+    pass
+
+
+def _spans(ents):
+    return [(e["start"], e["end"], e["label"]) for e in ents]
+
+
+def iter_gold(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                obj = json.loads(line)
+                yield obj["id"], _spans(obj.get("entities", []))
+
+
+def iter_pred(path):
+    for uid, ents in iter_pred_items(path):
+        yield uid, _spans(ents)
+
+
+def _ascending(items):
+    """
+    (id, spans) in ascending id order, keeping the last of repeated ids (as the
+    dict-based loaders do). Raises _Unsorted on the first id that goes back.
+    """
+    prev = None
+    for uid, spans in items:
+        if prev is not None:
+            if uid < prev[0]:
+                raise _Unsorted(uid)
+            if uid != prev[0]:
+                yield prev
+        prev = (uid, spans)
+    if prev is not None:
+        yield prev
+
+
+def sorted_join(gold_path, pred_path):
+    """Merge join of two id-sorted files: yields (gold spans, pred spans) per gold id."""
+    preds = _ascending(iter_pred(pred_path))
+    p = next(preds, None)
+    for uid, g_spans in _ascending(iter_gold(gold_path)):
+        while p is not None and p[0] < uid:
+            p = next(preds, None)
+        yield g_spans, p[1] if p is not None and p[0] == uid else []
+    for _ in preds:
+        pass  # an out-of-order id in the tail would have matched an earlier gold id
+
+
+def _index(db, table, path):
+    """id -> byte offset of its last line, for a JSONL file."""
+    db.execute(f"CREATE TABLE {table} (id TEXT PRIMARY KEY, off INTEGER)")
+    rows = []
+    off = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                rows.append((json.loads(line)["id"], off))
+                if len(rows) >= 10000:
+                    db.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?, ?)", rows)
+                    rows = []
+            off += len(line)
+    db.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?, ?)", rows)
+
+
+def _read_at(f, off):
+    f.seek(off)
+    return json.loads(f.readline())
+
+
+def index_join(gold_path, pred_path, tmp_dir=None):
+    """
+    Join through an on-disk SQLite index of id -> line offset, for files in
+    any order. A single-object pred .json cannot be seeked into, so that form
+    is held in memory instead.
+    """
+    pred_jsonl, pred_mem = is_jsonl_pred(pred_path), None
+    if not pred_jsonl:
+        pred_mem = {uid: _spans(ents) for uid, ents in iter_pred_items(pred_path)}
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp:
+        db = sqlite3.connect(os.path.join(tmp, "index.db"))
+        db.execute("PRAGMA journal_mode=OFF")
+        db.execute("PRAGMA synchronous=OFF")
+        _index(db, "gold", gold_path)
+        if pred_jsonl:
+            _index(db, "pred", pred_path)
+            query = "SELECT g.id, g.off, p.off FROM gold g LEFT JOIN pred p ON p.id = g.id ORDER BY g.off"
+        else:
+            query = "SELECT id, off, NULL FROM gold ORDER BY off"
+        with open(gold_path, "rb") as gf, open(pred_path, "rb") as pf:
+            for uid, g_off, p_off in db.execute(query):
+                g_spans = _spans(_read_at(gf, g_off).get("entities", []))
+                if not pred_jsonl:
+                    p_spans = pred_mem.get(uid, [])
+                elif p_off is None:
+                    p_spans = []
+                else:
+                    p_spans = _spans(_read_at(pf, p_off)["entities"])
+                yield g_spans, p_spans
+        db.close()
+
+
+class SpanCounts:
+    """
+    Every metric of `eval_span_f1.compute_metrics`, accumulated one utterance
+    at a time. Per-utterance PII tp / fp / fn are kept as int arrays for the
+    bootstrap.
+    """
+
+    def __init__(self):
+        self.labels = set()
+        self.tp = defaultdict(int)
+        self.fp = defaultdict(int)
+        self.fn = defaultdict(int)
+        self.pii = [0, 0, 0]
+        self.non = [0, 0, 0]
+        self.utt_pii = (array("i"), array("i"), array("i"))
+        self.n = 0
+
+    def add(self, g_spans, p_spans):
+        self.n += 1
+        g_set, p_set = set(g_spans), set(p_spans)
+        hits = g_set & p_set
+        self.labels.update(lab for _, _, lab in g_set)
+        for span in hits:
+            self.tp[span[2]] += 1
+        for span in p_set - hits:
+            self.fp[span[2]] += 1
+        for span in g_set - hits:
+            self.fn[span[2]] += 1
+
+        g_pii = {(s, e) for s, e, lab in g_set if lab in PII_LABELS}
+        g_non = {(s, e) for s, e, lab in g_set if lab not in PII_LABELS}
+        p_pii = {(s, e) for s, e, lab in p_set if lab in PII_LABELS}
+        p_non = {(s, e) for s, e, lab in p_set if lab not in PII_LABELS}
+        tp = len(p_pii & g_pii)
+        pii = (tp, len(p_pii) - tp, len(g_pii) - tp)
+        tp = len(p_non & g_non)
+        non = (tp, len(p_non) - tp, len(g_non) - tp)
+        for k in range(3):
+            self.pii[k] += pii[k]
+            self.non[k] += non[k]
+            self.utt_pii[k].append(pii[k])
+
+    def metrics(self):
+        per_entity = {}
+        for lab in sorted(self.labels):
+            p, r, f1 = compute_prf(self.tp[lab], self.fp[lab], self.fn[lab])
+            per_entity[lab] = {"precision": p, "recall": r, "f1": f1}
+        macro_f1 = sum(m["f1"] for m in per_entity.values()) / max(1, len(per_entity))
+        p, r, f1 = compute_prf(*self.pii)
+        p2, r2, f12 = compute_prf(*self.non)
+        return {
+            "per_entity": per_entity,
+            "macro_f1": macro_f1,
+            "pii": {"precision": p, "recall": r, "f1": f1},
+            "non_pii": {"precision": p2, "recall": r2, "f1": f12},
+        }
+
+
+_boot = {}
+
+
+def _init_boot(tp, fp, fn):
+    _boot.update(tp=np.frombuffer(tp, dtype=np.int32), fp=np.frombuffer(fp, dtype=np.int32),
+                 fn=np.frombuffer(fn, dtype=np.int32))
+
+
+def _boot_chunk(task):
+    seed, chunk, reps = task
+    rng = np.random.default_rng((seed, chunk))
+    tp, fp, fn = _boot["tp"], _boot["fp"], _boot["fn"]
+    out = []
+    for _ in range(reps):
+        idx = rng.integers(0, len(tp), len(tp))
+        out.append(compute_prf(int(tp[idx].sum()), int(fp[idx].sum()), int(fn[idx].sum())))
+    return out
+
+
+def bootstrap_pii(counts, reps=1000, confidence=0.95, workers=1, seed=0, chunk=50):
+    """
+    Percentile bootstrap over utterances for PII precision / recall / F1. Each
+    chunk of replicates has its own seed, so the interval does not depend on
+    the number of workers.
+    """
+    arrays = tuple(a.tobytes() for a in counts.utt_pii)
+    tasks = [(seed, k, min(chunk, reps - k * chunk)) for k in range(-(-reps // chunk))]
+    if workers <= 1:
+        _init_boot(*arrays)
+        results = [_boot_chunk(t) for t in tasks]
+    else:
+        with mp.get_context("spawn").Pool(workers, initializer=_init_boot, initargs=arrays) as pool:
+            results = pool.map(_boot_chunk, tasks)
+    samples = np.array([r for chunk_r in results for r in chunk_r])
+    lo, hi = 100 * (1 - confidence) / 2, 100 * (1 + confidence) / 2
+    return {name: {"low": float(np.percentile(samples[:, k], lo)),
+                   "high": float(np.percentile(samples[:, k], hi))}
+            for k, name in enumerate(("precision", "recall", "f1"))}
+
+
+def evaluate(gold_path, pred_path, join="auto", tmp_dir=None):
+    """One pass over the joined files. Returns (SpanCounts, join actually used)."""
+    if join in ("auto", "sorted"):
+        counts = SpanCounts()
+        try:
+            for g_spans, p_spans in sorted_join(gold_path, pred_path):
+                counts.add(g_spans, p_spans)
+            return counts, "sorted"
+        except _Unsorted as e:
+            if join == "sorted":
+                raise SystemExit(f"--join sorted: ids are not in ascending order (at {e.args[0]!r})")
+    counts = SpanCounts()
+    for g_spans, p_spans in index_join(gold_path, pred_path, tmp_dir):
+        counts.add(g_spans, p_spans)
+    return counts, "index"
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--gold", required=True)
+    ap.add_argument("--pred", required=True)
+    ap.add_argument("--join", choices=["auto", "sorted", "index"], default="auto",
+                    help="auto: merge join on sorted ids, falling back to an on-disk index")
+    ap.add_argument("--tmp_dir", default=None, help="where the index is built (default: system temp)")
+    ap.add_argument("--bootstrap", type=int, default=1000, help="replicates for PII CIs (0 to skip)")
+    ap.add_argument("--confidence", type=float, default=0.95)
+    ap.add_argument("--workers", type=int, default=os.cpu_count())
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--verify", action="store_true",
+                    help="also run the in-memory eval_span_f1 and fail on any difference")
+    ap.add_argument("--report", default=None, help="optional JSON report path")
+    args = ap.parse_args()
+
+    start = time.perf_counter()
+    counts, join = evaluate(args.gold, args.pred, args.join, args.tmp_dir)
+    metrics = counts.metrics()
+    elapsed = time.perf_counter() - start
+    print_metrics(metrics)
+    print(f"\n{counts.n} utterances in {elapsed:.2f}s ({join} join)")
+
+    report = {"utterances": counts.n, "join": join, "metrics": metrics}
+    if args.bootstrap > 0 and counts.n:
+        ci = bootstrap_pii(counts, args.bootstrap, args.confidence, args.workers, args.seed)
+        print(f"PII {args.confidence * 100:g}% bootstrap CIs ({args.bootstrap} replicates): "
+              + " ".join(f"{k[0].upper()}=[{v['low']:.3f}, {v['high']:.3f}]" for k, v in ci.items()))
+        report["pii_ci"] = {"confidence": args.confidence, "replicates": args.bootstrap, **ci}
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote report to {args.report}")
+
+    if args.verify:
+        if compute_metrics(load_gold(args.gold), load_pred(args.pred)) != metrics:
+            raise SystemExit("streaming metrics differ from eval_span_f1")
+        print("Identical to eval_span_f1.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import os
+import sys
+import json
+import time
+import argparse
+import warnings
+import subprocess
+import statistics
+
+import torch
+
+from fast_backend import GRAPH_FILE, META_FILE, TOKENIZER_FILE, WEIGHTS_FILE, _set_tensors, load_fast
+from predict import load_model, iter_records, predict_batch, predict_timed
+
+# one cold start: a fresh interpreter that imports predict.py, loads the model
+# and tags one utterance. Wall-clock stamps let the parent include interpreter
+# startup, which perf_counter inside the child cannot see.
+PROBE = """
+import sys, time, json
+t0 = time.time()
+sys.path.insert(0, sys.argv[1])
+from predict import load_model, predict_one
+t1 = time.time()
+tokenizer, model = load_model(sys.argv[2], backend=sys.argv[3])
+t2 = time.time()
+predict_one("my name is john and my email is john at gmail dot com", tokenizer, model)
+t3 = time.time()
+print(json.dumps({"started": t0, "import_s": t1 - t0, "load_s": t2 - t1, "first_pred_s": t3 - t2,
+                  "done": t3}))
+"""
+
+
+class _LogitsOnly(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask, return_dict=False)[0]
+
+
+def pack(model, tokenizer, out_dir):
+    """
+    Trace the model to TorchScript and split it into a small graph file with
+    empty parameter placeholders plus a plain state dict that the runtime
+    memory-maps, next to the serialized fast tokenizer.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    # a padded batch, so the traced graph keeps the attention-mask path
+    dummy = tokenizer(["my phone number is nine eight seven", "call me"], padding=True,
+                      return_tensors="pt")
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        traced = torch.jit.trace(_LogitsOnly(model).eval(),
+                                 (dummy["input_ids"], dummy["attention_mask"]), check_trace=False)
+
+    weights = {k: v.detach().clone() for k, v in traced.state_dict().items()}
+    torch.save(weights, os.path.join(out_dir, WEIGHTS_FILE))
+    _set_tensors(traced, {k: torch.empty(0, dtype=v.dtype) for k, v in weights.items()})
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", FutureWarning)
+        torch.jit.save(traced, os.path.join(out_dir, GRAPH_FILE))
+
+    tokenizer.backend_tokenizer.save(os.path.join(out_dir, TOKENIZER_FILE))
+    with open(os.path.join(out_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump({"pad_token_id": tokenizer.pad_token_id, "torch": torch.__version__}, f, indent=2)
+
+
+def cold_start(model_dir, backend, runs):
+    src = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for _ in range(runs):
+        start = time.time()
+        out = subprocess.run([sys.executable, "-c", PROBE, src, model_dir, backend],
+                             capture_output=True, text=True, check=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        r["total_s"] = r["done"] - start
+        r["startup_s"] = r["started"] - start
+        results.append(r)
+    keys = ("startup_s", "import_s", "load_s", "first_pred_s", "total_s")
+    return {k: statistics.median(r[k] for r in results) for k in keys}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--out_dir", default="out_fast")
+    ap.add_argument("--dev", default="data/dev.jsonl")
+    ap.add_argument("--max_length", type=int, default=128)
+    ap.add_argument("--atol", type=float, default=1e-4,
+                    help="max allowed |logit difference| vs the eager model")
+    ap.add_argument("--runs", type=int, default=5, help="cold starts per variant (0 to skip)")
+    ap.add_argument("--report", default=None, help="optional JSON report path")
+    args = ap.parse_args()
+
+    tokenizer, model = load_model(args.model_dir)
+    if hasattr(model, "exit_classifiers"):
+        # data-dependent exits cannot be traced; the artifact runs every layer
+        model.exit_threshold = None
+    pack(model, tokenizer, args.out_dir)
+    print(f"Packed {args.model_dir} into {args.out_dir}")
+
+    fast_tokenizer, fast_model = load_fast(args.out_dir)
+    records = list(iter_records(args.dev))
+    texts = [obj["text"] for obj in records]
+    ref_logits, ref_pred, _ = predict_timed(records, tokenizer, model, args.max_length)
+    new_logits, new_pred, _ = predict_timed(records, fast_tokenizer, fast_model, args.max_length)
+    max_diff = max(float((a - b).abs().max()) for a, b in zip(ref_logits, new_logits))
+    same = new_pred == ref_pred and \
+        predict_batch(texts, tokenizer, model, args.max_length, batch_size=16) == \
+        predict_batch(texts, fast_tokenizer, fast_model, args.max_length, batch_size=16)
+    print(f"Parity on {len(records)} dev utterances: max |logit diff| {max_diff:.2e}, "
+          f"identical spans (batch 1 and 16): {same}")
+
+    report = {"artifact": args.out_dir, "max_abs_logit_diff": max_diff, "identical_spans": same}
+    if args.runs > 0:
+        before = cold_start(args.model_dir, "torch", args.runs)
+        after = cold_start(args.out_dir, "fast", args.runs)
+        print(f"\nCold start, process start -> first prediction (median of {args.runs}):")
+        print(f"{'':14s} {'torch':>8s} {'fast':>8s}")
+        for key, name in (("startup_s", "interpreter"), ("import_s", "imports"), ("load_s", "load"),
+                          ("first_pred_s", "first predict"), ("total_s", "total")):
+            print(f"{name:14s} {before[key]:8.3f} {after[key]:8.3f}")
+        print(f"speedup: {before['total_s'] / after['total_s']:.2f}x")
+        report["cold_start_s"] = {"torch": before, "fast": after}
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote report to {args.report}")
+
+    if max_diff > args.atol or not same:
+        raise SystemExit(f"fast artifact disagrees with {args.model_dir} (max diff {max_diff:.2e})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import os
+import json
+import argparse
+import tempfile
+
+import torch
+
+from eval_span_f1 import load_gold, compute_metrics
+from latency_stats import summarize
+from onnx_backend import ONNX_FILE, OnnxTokenClassifier
+from predict import load_model, iter_records, predict_timed
+
+
+def export(model, tokenizer, path, opset=17):
+    dummy = tokenizer("my phone number is nine eight seven", return_tensors="pt")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (dummy["input_ids"], dummy["attention_mask"]),
+            path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "logits": {0: "batch", 1: "sequence"},
+            },
+            opset_version=opset,
+            do_constant_folding=True,
+        )
+
+
+def optimize(raw_path, out_path, config):
+    """
+    Fuse attention / layernorm / gelu with the onnxruntime transformer optimizer
+    when it is available; otherwise fall back to ORT's own offline graph
+    optimizations.
+    """
+    try:
+        from onnxruntime.transformers import optimizer
+
+        opt = optimizer.optimize_model(
+            raw_path,
+            model_type="bert",
+            num_heads=config.n_heads,
+            hidden_size=config.dim,
+        )
+        opt.save_model_to_file(out_path)
+        return "onnxruntime.transformers"
+    except ImportError:
+        import onnxruntime as ort
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        opts.optimized_model_filepath = out_path
+        ort.InferenceSession(raw_path, opts, providers=["CPUExecutionProvider"])
+        return "ORT_ENABLE_ALL"
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--output", default=None, help="defaults to <model_dir>/model.onnx")
+    ap.add_argument("--dev", default="data/dev.jsonl")
+    ap.add_argument("--max_length", type=int, default=128)
+    ap.add_argument("--opset", type=int, default=17)
+    ap.add_argument("--atol", type=float, default=1e-3,
+                    help="max allowed |logit difference| vs PyTorch")
+    ap.add_argument("--report", default=None, help="optional JSON report path")
+    args = ap.parse_args()
+
+    out_path = args.output or os.path.join(args.model_dir, ONNX_FILE)
+
+    tokenizer, model = load_model(args.model_dir)
+    # the exporter may write weights as external data next to the raw graph
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_path = os.path.join(tmp, "raw.onnx")
+        export(model, tokenizer, raw_path, args.opset)
+        how = optimize(raw_path, out_path, model.config)
+    print(f"Exported {out_path} (opset {args.opset}, optimized with {how})")
+
+    ort_model = OnnxTokenClassifier(out_path)
+
+    records = list(iter_records(args.dev))
+    gold = load_gold(args.dev)
+
+    # warm both paths so the first call does not skew latency
+    for m in (model, ort_model):
+        predict_timed(records[:5], tokenizer, m, args.max_length)
+
+    pt_logits, pt_pred, pt_ms = predict_timed(records, tokenizer, model, args.max_length)
+    ort_logits, ort_pred, ort_ms = predict_timed(records, tokenizer, ort_model, args.max_length)
+
+    max_diff = 0.0
+    agree = total = 0
+    for a, b in zip(pt_logits, ort_logits):
+        max_diff = max(max_diff, (a - b).abs().max().item())
+        agree += (a.argmax(-1) == b.argmax(-1)).sum().item()
+        total += a.shape[0]
+
+    pt_m = compute_metrics(gold, pt_pred)
+    ort_m = compute_metrics(gold, ort_pred)
+    pt_lat = summarize(pt_ms)
+    ort_lat = summarize(ort_ms)
+
+    print(f"\nParity on {len(records)} dev utterances:")
+    print(f"  max |logit diff|: {max_diff:.2e} (atol {args.atol:g})")
+    print(f"  argmax agreement: {agree}/{total} tokens")
+    print(f"\n{'':12s} {'torch':>9s} {'onnxruntime':>12s} {'delta':>9s}")
+    for name, a, b in [
+        ("PII P", pt_m["pii"]["precision"], ort_m["pii"]["precision"]),
+        ("PII F1", pt_m["pii"]["f1"], ort_m["pii"]["f1"]),
+        ("Macro-F1", pt_m["macro_f1"], ort_m["macro_f1"]),
+    ]:
+        print(f"{name:12s} {a:9.3f} {b:12.3f} {b - a:+9.3f}")
+    for q in ("p50", "p95"):
+        a, b = pt_lat[q], ort_lat[q]
+        print(f"{q + ' (ms)':12s} {a:9.2f} {b:12.2f} {b - a:+9.2f}")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({
+                "onnx_path": out_path,
+                "max_abs_logit_diff": max_diff,
+                "argmax_agreement": agree / max(1, total),
+                "torch": {"metrics": pt_m, "latency_ms": pt_lat},
+                "onnxruntime": {"metrics": ort_m, "latency_ms": ort_lat},
+            }, f, indent=2)
+        print(f"Wrote report to {args.report}")
+
+    if max_diff > args.atol:
+        raise SystemExit(f"ONNX logits differ from PyTorch by {max_diff:.2e} > atol {args.atol:g}")
+
+
+if __name__ == "__main__":
+    main()
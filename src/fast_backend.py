@@ -0,0 +1,114 @@
+import os
+import json
+import warnings
+from types import SimpleNamespace
+
+import torch
+
+GRAPH_FILE = "model.ts"
+WEIGHTS_FILE = "weights.pt"
+META_FILE = "fast_meta.json"
+TOKENIZER_FILE = "tokenizer.json"
+
+
+def _set_tensors(module, tensors):
+    for name, t in tensors.items():
+        *path, leaf = name.split(".")
+        m = module
+        for p in path:
+            m = getattr(m, p)
+        setattr(m, leaf, t)
+
+
+class FastTokenizer:
+    """
+    `tokenizers.Tokenizer` behind the subset of the transformers fast-tokenizer
+    call API that predict.py uses (offsets, truncation, overflowing windows,
+    `pad`), so the runtime never has to import transformers. The backend is the
+    same Rust tokenizer, so ids and offsets are identical.
+    """
+
+    def __init__(self, path, pad_token_id):
+        from tokenizers import Tokenizer
+
+        self._tok = Tokenizer.from_file(path)
+        self._tok.no_padding()
+        self._tok.no_truncation()
+        self.pad_token_id = pad_token_id
+
+    @property
+    def backend_tokenizer(self):
+        return self._tok
+
+    def __call__(self, text, return_offsets_mapping=False, truncation=False, max_length=None,
+                 stride=0, return_overflowing_tokens=False, return_tensors=None, **kwargs):
+        if truncation and max_length:
+            self._tok.enable_truncation(max_length, stride=stride)
+        else:
+            self._tok.no_truncation()
+        single = isinstance(text, str)
+        encodings = self._tok.encode_batch([text] if single else list(text))
+
+        rows, sample_map = [], []
+        for i, e in enumerate(encodings):
+            windows = [e] + (list(e.overflowing) if return_overflowing_tokens else [])
+            rows += windows
+            sample_map += [i] * len(windows)
+
+        out = {
+            "input_ids": [e.ids for e in rows],
+            "attention_mask": [e.attention_mask for e in rows],
+        }
+        if return_tensors == "pt":
+            out = self.pad(out, return_tensors="pt")
+        if return_offsets_mapping:
+            offsets = [e.offsets for e in rows]
+            out["offset_mapping"] = torch.tensor(offsets) if return_tensors == "pt" else offsets
+        if return_overflowing_tokens:
+            out["overflow_to_sample_mapping"] = sample_map
+        return out
+
+    def pad(self, enc, return_tensors="pt"):
+        width = max(len(ids) for ids in enc["input_ids"])
+        input_ids = [ids + [self.pad_token_id] * (width - len(ids)) for ids in enc["input_ids"]]
+        attention_mask = [list(m) + [0] * (width - len(m)) for m in enc["attention_mask"]]
+        return {"input_ids": torch.tensor(input_ids), "attention_mask": torch.tensor(attention_mask)}
+
+
+class FastTokenClassifier:
+    """
+    Traced TorchScript graph with its weights memory-mapped from a separate
+    file, wrapped like `OnnxTokenClassifier`: called with `input_ids` /
+    `attention_mask` and returns an object with a `.logits` tensor.
+    """
+
+    def __init__(self, artifact_dir, num_threads=None):
+        graph = os.path.join(artifact_dir, GRAPH_FILE)
+        if not os.path.exists(graph):
+            raise FileNotFoundError(f"{graph} not found; run src/export_fast.py first")
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", FutureWarning)  # TorchScript deprecation notice
+            self.module = torch.jit.load(graph, map_location="cpu")
+        # the graph file only holds empty placeholders; the real weights are
+        # paged in from disk on first use
+        weights = torch.load(os.path.join(artifact_dir, WEIGHTS_FILE), mmap=True, weights_only=True)
+        _set_tensors(self.module, weights)
+        self.module.eval()
+
+    def to(self, device):
+        return self
+
+    def eval(self):
+        return self
+
+    def __call__(self, input_ids, attention_mask, **kwargs):
+        return SimpleNamespace(logits=self.module(input_ids.cpu(), attention_mask.cpu()))
+
+
+def load_fast(artifact_dir, num_threads=None):
+    with open(os.path.join(artifact_dir, META_FILE), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    tokenizer = FastTokenizer(os.path.join(artifact_dir, TOKENIZER_FILE), meta["pad_token_id"])
+    return tokenizer, FastTokenClassifier(artifact_dir, num_threads)
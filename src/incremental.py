@@ -0,0 +1,102 @@
+import re
+from bisect import bisect_left, bisect_right
+
+from predict import predict_windowed, spans_to_ents
+
+WORD_START = re.compile(r"(?:^|(?<=\s))\S")
+
+
+class IncrementalTagger:
+    """
+    Stateful tagger for a growing STT transcript. Each `update` applies a text
+    delta and re-runs the model only on a trailing window that starts
+    `context_words` words before the changed region (pulled back further if a
+    span straddles that point). Spans that end before the window are kept as
+    they are, and word starts are tracked as the text grows, so work per
+    update stays bounded instead of growing with the prefix. `update` returns
+    add/update/retract events with offsets into the full transcript.
+    """
+
+    def __init__(self, tokenizer, model, max_length=128, stride=32, context_words=12, device="cpu"):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.max_length = max_length
+        self.stride = stride
+        self.context_words = context_words
+        self.device = device
+        self.text = ""
+        self.spans = []  # sorted and non-overlapping, so ends are sorted too
+        self.word_starts = []
+
+    def _window_start(self, changed_at):
+        n = bisect_left(self.word_starts, changed_at)
+        if n <= self.context_words:
+            return 0
+        ws = self.word_starts[n - self.context_words]
+        # never cut through a span; re-tag it as a whole
+        i = bisect_left(self.spans, ws, key=lambda sp: sp[1])
+        if i < len(self.spans) and self.spans[i][0] < ws:
+            ws = self.spans[i][0]
+        return ws
+
+    def update(self, delta, start=None):
+        """
+        Apply `delta` at character `start` (default: append), replacing
+        everything after `start`, as STT partial hypotheses do when they revise
+        their tail. Returns the list of span events this update caused.
+        """
+        start = min(len(self.text), len(self.text) if start is None else start)
+        self.text = self.text[:start] + delta
+        # word starts before `start` only depend on text that did not change
+        del self.word_starts[bisect_left(self.word_starts, start):]
+        self.word_starts.extend(m.start() for m in WORD_START.finditer(self.text, start))
+
+        ws = self._window_start(start)
+        k = bisect_right(self.spans, ws, key=lambda sp: sp[1])
+        window = self.text[ws:]
+        fresh = []
+        if window.strip():
+            spans = predict_windowed([window], self.tokenizer, self.model, self.max_length,
+                                     self.stride, self.device, batch_size=8)[0]
+            fresh = [(s + ws, e + ws, lab) for s, e, lab in spans]
+
+        # spans ending before the window are kept, so only the tail can change
+        old = self.spans[k:]
+        del self.spans[k:]
+        self.spans.extend(fresh)
+        return diff_spans(old, fresh)
+
+    def entities(self):
+        return spans_to_ents(self.spans)
+
+    def reset(self):
+        self.text = ""
+        self.spans = []
+        self.word_starts = []
+
+
+def _ent(span):
+    return spans_to_ents([span])[0]
+
+
+def diff_spans(old, new):
+    """
+    Events that turn `old` into `new`: unchanged spans produce nothing, a new
+    span overlapping a removed one of the same label is an `update` (typically
+    an entity growing as more words arrive), anything else is `add` / `retract`.
+    """
+    old_set, new_set = set(old), set(new)
+    removed = [sp for sp in old if sp not in new_set]
+    added = [sp for sp in new if sp not in old_set]
+
+    events = []
+    for sp in added:
+        prev = next((r for r in removed if r[2] == sp[2] and r[0] < sp[1] and sp[0] < r[1]), None)
+        if prev is not None:
+            removed.remove(prev)
+            events.append({"type": "update", "span": _ent(sp), "previous": _ent(prev)})
+        else:
+            events.append({"type": "add", "span": _ent(sp)})
+    for sp in removed:
+        events.append({"type": "retract", "span": _ent(sp)})
+    return events
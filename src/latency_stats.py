@@ -0,0 +1,24 @@
+import math
+
+
+def percentile(values, q):
+    """
+    Linear-interpolated percentile (same as numpy's default), q in [0, 100].
+    """
+    if not values:
+        return float("nan")
+    xs = sorted(values)
+    if len(xs) == 1:
+        return xs[0]
+    pos = (len(xs) - 1) * q / 100.0
+    lo = math.floor(pos)
+    hi = math.ceil(pos)
+    return xs[lo] + (xs[hi] - xs[lo]) * (pos - lo)
+
+
+def summarize(times_ms, qs=(50, 95, 99)):
+    out = {f"p{q}": percentile(times_ms, q) for q in qs}
+    out["max"] = max(times_ms) if times_ms else float("nan")
+    out["mean"] = sum(times_ms) / len(times_ms) if times_ms else float("nan")
+    out["n"] = len(times_ms)
+    return out
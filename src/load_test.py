@@ -0,0 +1,142 @@
+import json
+import time
+import random
+import socket
+import argparse
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+from latency_stats import summarize
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=10.0):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+class Client:
+    def __init__(self, host, port, unix_socket=None, timeout=10.0):
+        self.host = host
+        self.port = port
+        self.unix_socket = unix_socket
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.unix_socket:
+                conn = UnixHTTPConnection(self.unix_socket, timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def predict(self, text):
+        body = json.dumps({"text": text})
+        conn = self._conn()
+        try:
+            conn.request("POST", "/predict", body=body, headers={"Content-Type": "application/json"})
+            resp = conn.getresponse()
+            data = resp.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            raise
+        if resp.status != 200:
+            raise RuntimeError(f"HTTP {resp.status}: {data[:200]!r}")
+        return json.loads(data)
+
+
+def run_rate(client, texts, rate, n_requests, concurrency, rng):
+    """
+    Open-loop load: requests are fired on a Poisson schedule at `rate` req/s
+    regardless of how fast earlier ones complete, so queueing delay shows up in
+    the measured latency.
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def fire(text, scheduled):
+        try:
+            client.predict(text)
+        except Exception:
+            with lock:
+                errors[0] += 1
+            return
+        # measure from the scheduled send time to include client-side queueing
+        with lock:
+            latencies.append((time.perf_counter() - scheduled) * 1000.0)
+
+    t0 = time.perf_counter()
+    next_t = t0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i in range(n_requests):
+            next_t += rng.expovariate(rate)
+            delay = next_t - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(fire, texts[i % len(texts)], next_t)
+    elapsed = time.perf_counter() - t0
+
+    stats = summarize(latencies)
+    stats["rate"] = rate
+    stats["achieved_rps"] = len(latencies) / elapsed if elapsed > 0 else 0.0
+    stats["errors"] = errors[0]
+    return stats
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--unix_socket", default=None)
+    ap.add_argument("--input", default="data/dev.jsonl")
+    ap.add_argument("--rates", default="10,50,100,200",
+                    help="comma-separated request rates (req/s) to test")
+    ap.add_argument("--requests", type=int, default=500, help="requests per rate")
+    ap.add_argument("--concurrency", type=int, default=64)
+    ap.add_argument("--warmup", type=int, default=20)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--output", default=None, help="optional JSON report path")
+    args = ap.parse_args()
+
+    texts = []
+    with open(args.input, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                texts.append(json.loads(line)["text"])
+    if not texts:
+        print("No texts found in input file.")
+        return
+
+    client = Client(args.host, args.port, args.unix_socket)
+    for i in range(args.warmup):
+        client.predict(texts[i % len(texts)])
+
+    rng = random.Random(args.seed)
+    rows = []
+    print(f"{'rate':>8} {'achieved':>9} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'errors':>6}")
+    for rate in [float(r) for r in args.rates.split(",") if r.strip()]:
+        s = run_rate(client, texts, rate, args.requests, args.concurrency, rng)
+        rows.append(s)
+        print(f"{rate:8.1f} {s['achieved_rps']:9.1f} {s['p50']:8.2f} {s['p95']:8.2f} "
+              f"{s['p99']:8.2f} {s['max']:8.2f} {s['errors']:6d}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+        print(f"Wrote report to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,107 @@
+import os
 import json
 import time
 import argparse
 import statistics
 
 import torch
-from transformers import AutoTokenizer, AutoModelForTokenClassification
+
+from latency_stats import summarize
+from predict import bio_to_spans, iter_records, load_model, spans_to_ents
+import profiling
+
+STAGES = ("tokenize", "forward", "argmax", "decode", "end_to_end")
+QUANTILES = (50, 90, 95, 99)
+
+
+def texts_of_length(texts, tokenizer, length):
+    """
+    Inputs that fill exactly `length` tokens once truncated: consecutive dev
+    texts joined until they are long enough.
+    """
+    out, cur = [], ""
+    for i in range(len(texts) * (1 + length)):
+        cur = f"{cur} {texts[i % len(texts)]}".strip()
+        if len(tokenizer(cur)["input_ids"]) >= length:
+            out.append(cur)
+            cur = ""
+            if len(out) >= len(texts):
+                break
+    return out
+
+
+def sync(device):
+    if str(device).startswith("cuda"):
+        torch.cuda.synchronize()
+
+
+def run_one(text, tokenizer, model, max_length, device):
+    """Tags one utterance the way predict.py does, timing each stage (ms)."""
+    t0 = time.perf_counter()
+    with profiling.stage("tokenize"):
+        enc = tokenizer(text, return_offsets_mapping=True, truncation=True, max_length=max_length,
+                        return_tensors="pt")
+    t1 = time.perf_counter()
+    with profiling.stage("forward"), torch.no_grad():
+        logits = model(input_ids=enc["input_ids"].to(device),
+                       attention_mask=enc["attention_mask"].to(device)).logits[0]
+        sync(device)
+    t2 = time.perf_counter()
+    with profiling.stage("argmax"):
+        pred_ids = logits.argmax(dim=-1).cpu().tolist()
+    t3 = time.perf_counter()
+    with profiling.stage("decode"):
+        spans_to_ents(bio_to_spans(text, enc["offset_mapping"][0].tolist(), pred_ids))
+    t4 = time.perf_counter()
+    return {"tokenize": (t1 - t0) * 1000.0, "forward": (t2 - t1) * 1000.0,
+            "argmax": (t3 - t2) * 1000.0, "decode": (t4 - t3) * 1000.0,
+            "end_to_end": (t4 - t0) * 1000.0}
+
+
+def measure(texts, tokenizer, model, max_length, device, runs, warmup):
+    for i in range(warmup):
+        run_one(texts[i % len(texts)], tokenizer, model, max_length, device)
+    times = {s: [] for s in STAGES}
+    exit_layers = []
+    for i in range(runs):
+        for stage, ms in run_one(texts[i % len(texts)], tokenizer, model, max_length, device).items():
+            times[stage].append(ms)
+        if hasattr(model, "last_exit_layer"):
+            exit_layers.append(model.last_exit_layer)
+        profiling.step()
+    return times, exit_layers
+
+
+def compare(results, baseline_path, tolerance, min_delta_ms):
+    """
+    Diff against an earlier report, matching cells on (threads, length).
+    A stage regresses when a percentile grows by more than `tolerance`
+    (relative) and `min_delta_ms` (absolute). Returns the regressions.
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(r["threads"], r["length"]): r for r in json.load(f)["results"]}
+
+    regressions = []
+    print(f"\nCompared with {baseline_path}:")
+    print(f"{'threads':>7} {'length':>6} {'stage':>10} {'pct':>4} {'base ms':>8} {'new ms':>8} "
+          f"{'delta':>8}")
+    for r in results:
+        old = baseline.get((r["threads"], r["length"]))
+        if old is None:
+            print(f"{r['threads']:7d} {r['length']!s:>6} {'':>10} (not in baseline)")
+            continue
+        for stage in STAGES:
+            for q in ("p50", "p95", "p99"):
+                a, b = old["stages"][stage][q], r["stages"][stage][q]
+                bad = b > a * (1 + tolerance) and b - a > min_delta_ms
+                if bad:
+                    regressions.append({"threads": r["threads"], "length": r["length"],
+                                        "stage": stage, "quantile": q, "baseline_ms": a, "ms": b})
+                if stage == "end_to_end" or bad:
+                    flag = "  REGRESSION" if bad else ""
+                    print(f"{r['threads']:7d} {r['length']!s:>6} {stage:>10} {q:>4} {a:8.2f} {b:8.2f} "
+                          f"{(b - a) / a * 100 if a else 0.0:+7.1f}%{flag}")
+    return regressions
 
 
 def main():
@@ -13,60 +110,107 @@ def main():
     ap.add_argument("--model_name", default=None)
     ap.add_argument("--input", default="data/dev.jsonl")
     ap.add_argument("--max_length", type=int, default=128)
-    ap.add_argument("--runs", type=int, default=50)
-    ap.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    ap.add_argument("--runs", type=int, default=200, help="timed utterances per configuration")
+    ap.add_argument("--warmup", type=int, default=20, help="untimed utterances per configuration")
+    ap.add_argument("--threads", default=None,
+                    help="comma-separated torch intra-op thread counts to sweep (default: current)")
+    ap.add_argument("--lengths", default="dev",
+                    help="comma-separated input lengths in tokens; 'dev' = the input texts as they are")
+    ap.add_argument("--report", default=None, help="write the results as JSON")
+    ap.add_argument("--compare", default=None, help="baseline report to diff against")
+    ap.add_argument("--tolerance", type=float, default=0.10,
+                    help="relative slowdown vs --compare that counts as a regression")
+    ap.add_argument("--min_delta_ms", type=float, default=0.5,
+                    help="ignore slowdowns smaller than this many ms")
+    ap.add_argument("--backend", choices=["torch", "onnxruntime", "fast"], default="torch",
+                    help="fast: --model_dir is an artifact written by src/export_fast.py")
+    ap.add_argument("--onnx_path", default=None, help="defaults to <model_dir>/model.onnx")
+    ap.add_argument("--quantized", action="store_true",
+                    help="load the int8 artifact written by src/quantize.py")
+    ap.add_argument("--exit_threshold", type=float, default=None,
+                    help="confidence threshold for early-exit checkpoints (train.py --early_exit)")
+    ap.add_argument("--device", default=None,
+                    help="default: cuda when available, cpu for --backend fast")
+    profiling.add_profile_args(ap)
+    ap.add_argument("--profile_dir", default=None, help="defaults to <model_dir>/profile")
     args = ap.parse_args()
+    if args.device is None:
+        args.device = "cuda" if torch.cuda.is_available() and args.backend != "fast" else "cpu"
 
-    tokenizer = AutoTokenizer.from_pretrained(args.model_dir if args.model_name is None else args.model_name)
-    model = AutoModelForTokenClassification.from_pretrained(args.model_dir, ignore_mismatched_sizes=True)
-    model.to(args.device)
-    model.eval()
-
-    texts = []
-    with open(args.input, "r", encoding="utf-8") as f:
-        for line in f:
-            obj = json.loads(line)
-            texts.append(obj["text"])
+    if args.quantized and args.backend == "torch":
+        args.device = "cpu"
+    load_kwargs = dict(model_name=args.model_name, device=args.device, backend=args.backend,
+                       onnx_path=args.onnx_path, quantized=args.quantized,
+                       exit_threshold=args.exit_threshold)
+    tokenizer, model = load_model(args.model_dir, **load_kwargs)
 
+    texts = [obj["text"] for obj in iter_records(args.input)]
     if not texts:
         print("No texts found in input file.")
         return
 
-    times_ms = []
-
-    # warmup
-    for _ in range(5):
-        t = texts[0]
-        enc = tokenizer(
-            t,
-            truncation=True,
-            max_length=args.max_length,
-            return_tensors="pt",
-        )
-        with torch.no_grad():
-            _ = model(input_ids=enc["input_ids"].to(args.device), attention_mask=enc["attention_mask"].to(args.device))
-
-    for i in range(args.runs):
-        t = texts[i % len(texts)]
-        enc = tokenizer(
-            t,
-            truncation=True,
-            max_length=args.max_length,
-            return_tensors="pt",
-        )
-        start = time.perf_counter()
-        with torch.no_grad():
-            _ = model(input_ids=enc["input_ids"].to(args.device), attention_mask=enc["attention_mask"].to(args.device))
-        end = time.perf_counter()
-        times_ms.append((end - start) * 1000.0)
-
-    p50 = statistics.median(times_ms)
-    times_sorted = sorted(times_ms)
-    p95 = times_sorted[int(0.95 * len(times_sorted)) - 1]
-
-    print(f"Latency over {args.runs} runs (batch_size=1):")
-    print(f"  p50: {p50:.2f} ms")
-    print(f"  p95: {p95:.2f} ms")
+    threads = [int(t) for t in args.threads.split(",")] if args.threads else [torch.get_num_threads()]
+    lengths = [l if l == "dev" else int(l) for l in args.lengths.split(",")]
+
+    results = []
+    profile_dir = args.profile_dir or os.path.join(args.model_dir, "profile")
+    with profiling.session(args.profile, profile_dir, "measure_latency", args.profile_wait,
+                           args.profile_warmup, args.profile_steps):
+        for n_threads in threads:
+            torch.set_num_threads(n_threads)
+            if args.backend == "onnxruntime":
+                # ORT sizes its thread pool when the session is created
+                tokenizer, model = load_model(args.model_dir, num_threads=n_threads, **load_kwargs)
+            for length in lengths:
+                if length == "dev":
+                    inputs, max_length = texts, args.max_length
+                else:
+                    inputs, max_length = texts_of_length(texts, tokenizer, length), length
+                times, exit_layers = measure(inputs, tokenizer, model, max_length, args.device,
+                                             args.runs, args.warmup)
+                stages = {s: summarize(times[s], QUANTILES) for s in STAGES}
+                row = {"threads": n_threads, "length": length, "stages": stages}
+
+                print(f"\nthreads={n_threads} length={length} runs={args.runs} (batch_size=1, "
+                      f"backend={args.backend}{', int8' if args.quantized else ''}):")
+                print(f"  {'stage':10s} " + " ".join(f"{'p' + str(q):>7s}" for q in QUANTILES)
+                      + f" {'max':>7s} {'mean':>7s}")
+                for s in STAGES:
+                    st = stages[s]
+                    print(f"  {s:10s} " + " ".join(f"{st['p' + str(q)]:7.2f}" for q in QUANTILES)
+                          + f" {st['max']:7.2f} {st['mean']:7.2f}")
+
+                if exit_layers:
+                    row["avg_exit_layer"] = sum(exit_layers) / len(exit_layers)
+                    print(f"  avg exit layer: {row['avg_exit_layer']:.2f} / {model.n_layers} "
+                          f"(threshold={model.exit_threshold})")
+                    for layer in range(1, model.n_layers + 1):
+                        at = [t for t, l in zip(times["forward"], exit_layers) if l == layer]
+                        if at:
+                            print(f"    exit@{layer}: {len(at):4d} runs, median forward "
+                                  f"{statistics.median(at):.2f} ms")
+                results.append(row)
+
+    report = {
+        "model_dir": args.model_dir,
+        "backend": args.backend,
+        "quantized": args.quantized,
+        "device": args.device,
+        "runs": args.runs,
+        "warmup": args.warmup,
+        "torch": torch.__version__,
+        "results": results,
+    }
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote report to {args.report}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance, args.min_delta_ms)
+        if regressions:
+            raise SystemExit(f"{len(regressions)} latency regressions vs {args.compare}")
+        print("No regressions.")
 
 
 if __name__ == "__main__":
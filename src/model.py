@@ -1,19 +1,215 @@
-from transformers import AutoModelForTokenClassification
+import os
+import copy
+
+from transformers import AutoConfig, AutoModelForTokenClassification, DistilBertForTokenClassification
+from transformers.modeling_outputs import TokenClassifierOutput
+from transformers.pytorch_utils import prune_linear_layer
 from labels import LABEL2ID, ID2LABEL
 import torch
+from torch import nn
+
+
+class _EarlyExit(Exception):
+    def __init__(self, logits, layer):
+        self.logits = logits
+        self.layer = layer
+
+
+class DistilBertEarlyExitForTokenClassification(DistilBertForTokenClassification):
+    """
+    DistilBERT tagger with an extra token classifier after every transformer
+    layer but the last (which keeps the usual `classifier`). Training sums the
+    cross-entropy of all exits, weighted towards deeper layers. At inference,
+    with `exit_threshold` set, the forward pass stops after the first layer at
+    which every real token's max softmax probability reaches the threshold;
+    the layer it stopped at is left in `last_exit_layer`.
+
+    The checkpoint is a superset of a plain `DistilBertForTokenClassification`,
+    so it still loads through `AutoModelForTokenClassification` (exit heads are
+    then ignored and all layers run).
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        config.early_exit = True
+        self.n_layers = config.n_layers
+        self.exit_classifiers = nn.ModuleList(
+            [nn.Linear(config.dim, config.num_labels) for _ in range(config.n_layers - 1)]
+        )
+        self.exit_threshold = getattr(config, "exit_threshold", None)
+        self.last_exit_layer = None
+        self._exit_state = None
+        for i, layer in enumerate(self.distilbert.transformer.layer):
+            layer.register_forward_hook(self._layer_hook(i))
+        self.post_init()
+
+    def _layer_hook(self, idx):
+        def hook(module, inputs, output):
+            state = self._exit_state
+            if state is None:
+                return
+            hidden = output[0] if isinstance(output, tuple) else output
+            if state["threshold"] is None:
+                state["hidden"].append(hidden)
+                return
+            if idx >= len(self.exit_classifiers):
+                return
+            logits = self.exit_classifiers[idx](hidden)
+            conf = logits.softmax(-1).max(-1).values
+            if state["mask"] is not None:
+                conf = conf.masked_fill(state["mask"] == 0, 1.0)
+            if bool((conf >= state["threshold"]).all()):
+                raise _EarlyExit(logits, idx + 1)
+
+        return hook
+
+    def forward(self, input_ids=None, attention_mask=None, labels=None, exit_threshold=None, **kwargs):
+        threshold = self.exit_threshold if exit_threshold is None else exit_threshold
+        if self.training or labels is not None or threshold is None:
+            return self._forward_all_exits(input_ids, attention_mask, labels, **kwargs)
+
+        self._exit_state = {"threshold": threshold, "mask": attention_mask, "hidden": []}
+        try:
+            out = super().forward(input_ids=input_ids, attention_mask=attention_mask, **kwargs)
+            self.last_exit_layer = self.n_layers
+            return out
+        except _EarlyExit as e:
+            self.last_exit_layer = e.layer
+            return TokenClassifierOutput(logits=e.logits)
+        finally:
+            self._exit_state = None
+
+    def _forward_all_exits(self, input_ids, attention_mask, labels, **kwargs):
+        self._exit_state = {"threshold": None, "mask": attention_mask, "hidden": []}
+        try:
+            out = super().forward(input_ids=input_ids, attention_mask=attention_mask, **kwargs)
+            hidden = self._exit_state["hidden"]
+        finally:
+            self._exit_state = None
+        self.last_exit_layer = self.n_layers
+
+        if labels is None:
+            return out
+
+        loss_fct = nn.CrossEntropyLoss()
+        num_labels = self.config.num_labels
+        loss = self.n_layers * loss_fct(out.logits.view(-1, num_labels), labels.view(-1))
+        for i, head in enumerate(self.exit_classifiers):
+            logits = head(self.dropout(hidden[i]))
+            loss = loss + (i + 1) * loss_fct(logits.view(-1, num_labels), labels.view(-1))
+        loss = loss / (self.n_layers * (self.n_layers + 1) / 2)
+        return TokenClassifierOutput(loss=loss, logits=out.logits)
 
 
-def create_model(model_name: str):
-    model = AutoModelForTokenClassification.from_pretrained(
+def create_model(model_name: str, early_exit: bool = False):
+    cls = DistilBertEarlyExitForTokenClassification if early_exit else AutoModelForTokenClassification
+    model = cls.from_pretrained(
         model_name,
         num_labels=len(LABEL2ID),
         id2label=ID2LABEL,
         label2id=LABEL2ID
     )
-    '''
-    if hasattr(model, "distilbert"):  # Ensure it's a DistilBERT architecture
-        model.distilbert.transformer.layer[0].attention.prune_heads({2, 5})
-        model.distilbert.transformer.layer[3].attention.prune_heads({1, 4})
-    '''
-    
+    return model
+
+
+def create_student(teacher, n_layers, dim=None, n_heads=None, hidden_dim=None):
+    """
+    Smaller DistilBERT tagger with the teacher's vocabulary and label space.
+    When the width matches the teacher, embeddings and classifier are copied,
+    and so are evenly spaced teacher layers (always including the last one)
+    if their shapes match too; anything else starts from random init.
+    """
+    config = copy.deepcopy(teacher.config)
+    for key in ("early_exit", "exit_threshold", "head_pruning"):
+        if hasattr(config, key):
+            delattr(config, key)
+    config.architectures = ["DistilBertForTokenClassification"]
+    config.n_layers = n_layers
+    config.dim = dim or teacher.config.dim
+    config.n_heads = n_heads or (teacher.config.n_heads if dim is None else max(1, config.dim // 64))
+    config.hidden_dim = hidden_dim or (teacher.config.hidden_dim if dim is None else 4 * config.dim)
+    student = DistilBertForTokenClassification(config)
+
+    src, dst = teacher.distilbert, student.distilbert
+    if config.dim == teacher.config.dim:
+        dst.embeddings.load_state_dict(src.embeddings.state_dict())
+        student.classifier.load_state_dict(teacher.classifier.state_dict())
+    same_layers = (config.dim == teacher.config.dim and config.n_heads == teacher.config.n_heads
+                   and config.hidden_dim == teacher.config.hidden_dim
+                   and not getattr(teacher.config, "head_pruning", None))
+    if same_layers:
+        last = teacher.config.n_layers - 1
+        picks = [last] if n_layers == 1 else [round(i * last / (n_layers - 1)) for i in range(n_layers)]
+        for i, j in enumerate(picks):
+            dst.transformer.layer[i].load_state_dict(src.transformer.layer[j].state_dict())
+    return student
+
+
+def _remove_heads(model, heads):
+    if not hasattr(model, "distilbert"):
+        raise ValueError(f"head pruning is only implemented for DistilBERT, not {type(model).__name__}")
+    n_heads = model.config.n_heads
+    for layer, drop in heads.items():
+        drop = set(drop)
+        if not drop:
+            continue
+        attn = model.distilbert.transformer.layer[int(layer)].attention
+        if len(drop) >= n_heads:
+            raise ValueError(f"cannot remove all {n_heads} heads of layer {layer}")
+        size = attn.attention_head_size
+        keep = torch.tensor([h * size + i for h in range(n_heads) if h not in drop for i in range(size)])
+        attn.q_lin = prune_linear_layer(attn.q_lin, keep)
+        attn.k_lin = prune_linear_layer(attn.k_lin, keep)
+        attn.v_lin = prune_linear_layer(attn.v_lin, keep)
+        attn.out_lin = prune_linear_layer(attn.out_lin, keep, dim=1)
+        attn.n_heads = n_heads - len(drop)
+        attn.dim = attn.n_heads * size
+
+
+def prune_heads(model, heads):
+    """
+    Physically remove attention heads from a DistilBERT tagger. `heads` maps a
+    layer index to the head ids to drop; the q/k/v projections lose those
+    heads' output rows and `out_lin` the matching input columns. The removed
+    heads are recorded as `config.head_pruning`, so `model_from_config` can
+    rebuild the same shapes at load time. (Not `config.pruned_heads`: older
+    transformers releases re-apply that one by themselves.)
+    """
+    if getattr(model.config, "head_pruning", None):
+        raise ValueError("model is already pruned; prune the unpruned checkpoint instead")
+    heads = {int(l): sorted(set(h)) for l, h in heads.items() if h}
+    _remove_heads(model, heads)
+    model.config.head_pruning = {str(l): h for l, h in sorted(heads.items())}
+    return model
+
+
+def model_from_config(config):
+    """
+    Randomly initialised model with the checkpoint's architecture, including
+    any heads removed by `prune_heads`.
+    """
+    if getattr(config, "early_exit", False):
+        model = DistilBertEarlyExitForTokenClassification(config)
+    else:
+        model = AutoModelForTokenClassification.from_config(config)
+    if getattr(config, "head_pruning", None):
+        _remove_heads(model, config.head_pruning)
+    return model
+
+
+def load_pruned(model_dir):
+    """
+    Load a checkpoint saved after `prune_heads`. The architecture is rebuilt
+    with the pruned shapes first and the weights are then loaded strictly, so
+    a checkpoint that does not match its config fails loudly.
+    """
+    config = AutoConfig.from_pretrained(model_dir)
+    model = model_from_config(config)
+    path = os.path.join(model_dir, "model.safetensors")
+    if os.path.exists(path):
+        from safetensors.torch import load_file
+        state = load_file(path)
+    else:
+        state = torch.load(os.path.join(model_dir, "pytorch_model.bin"), map_location="cpu")
+    model.load_state_dict(state, strict=True)
     return model
@@ -0,0 +1,43 @@
+import os
+from types import SimpleNamespace
+
+import torch
+
+ONNX_FILE = "model.onnx"
+ONNX_INT8_FILE = "model.int8.onnx"
+
+
+class OnnxTokenClassifier:
+    """
+    Thin wrapper around an onnxruntime session that mimics the bits of
+    `AutoModelForTokenClassification` used by predict.py / measure_latency.py:
+    it is called with `input_ids` / `attention_mask` tensors and returns an
+    object with a `.logits` tensor.
+    """
+
+    def __init__(self, path, num_threads=None):
+        import onnxruntime as ort
+
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found; run src/export_onnx.py first")
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            opts.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def to(self, device):
+        return self
+
+    def eval(self):
+        return self
+
+    def __call__(self, input_ids, attention_mask, **kwargs):
+        feeds = {
+            "input_ids": input_ids.cpu().numpy(),
+            "attention_mask": attention_mask.cpu().numpy(),
+        }
+        feeds = {k: v for k, v in feeds.items() if k in self.input_names}
+        logits = self.session.run(["logits"], feeds)[0]
+        return SimpleNamespace(logits=torch.from_numpy(logits))
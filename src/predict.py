@@ -1,8 +1,14 @@
 import json
+import time
 import argparse
+import queue
+import traceback
+import multiprocessing as mp
+from collections import deque
 import torch
-from transformers import AutoTokenizer, AutoModelForTokenClassification
 from labels import ID2LABEL, label_is_pii
+from decode import batch_bio_to_spans
+import profiling
 import os
 
 
@@ -45,6 +51,476 @@ def bio_to_spans(text, offsets, label_ids):
     return spans
 
 
+def spans_to_ents(spans):
+    ents = []
+    for s, e, lab in spans:
+        ents.append(
+            {
+                "start": int(s),
+                "end": int(e),
+                "label": lab,
+                "pii": bool(label_is_pii(lab)),
+            }
+        )
+    return ents
+
+
+def load_model(model_dir, model_name=None, device="cpu", backend="torch", onnx_path=None,
+               quantized=False, num_threads=None, exit_threshold=None):
+    if backend == "fast":
+        # packed artifact from export_fast.py: no transformers import at all. It
+        # carries its own tokenizer and fp32 weights and runs on CPU only.
+        unsupported = [name for name, value in (("model_name", model_name), ("onnx_path", onnx_path),
+                                                ("quantized", quantized),
+                                                ("exit_threshold", exit_threshold))
+                       if value not in (None, False)]
+        if str(device) != "cpu":
+            unsupported.append(f"device={device!r}")
+        if unsupported:
+            raise ValueError(f"backend='fast' does not support {', '.join(unsupported)}: the "
+                             f"exported artifact runs as is on CPU; use the torch or "
+                             f"onnxruntime backend for these options")
+        from fast_backend import load_fast
+        return load_fast(model_dir, num_threads)
+
+    from transformers import AutoConfig, AutoTokenizer, AutoModelForTokenClassification
+    tokenizer = AutoTokenizer.from_pretrained(
+        model_dir if model_name is None else model_name)
+    if backend == "onnxruntime":
+        from onnx_backend import ONNX_FILE, ONNX_INT8_FILE, OnnxTokenClassifier
+        default = ONNX_INT8_FILE if quantized else ONNX_FILE
+        model = OnnxTokenClassifier(onnx_path or os.path.join(model_dir, default), num_threads)
+    elif quantized:
+        from quantize import load_quantized
+        model = load_quantized(model_dir)
+        device = "cpu"  # int8 dynamic kernels are CPU-only
+    else:
+        config = AutoConfig.from_pretrained(model_dir)
+        if getattr(config, "head_pruning", None):
+            from model import load_pruned
+            model = load_pruned(model_dir)
+        elif getattr(config, "early_exit", False):
+            from model import DistilBertEarlyExitForTokenClassification
+            model = DistilBertEarlyExitForTokenClassification.from_pretrained(model_dir)
+        else:
+            model = AutoModelForTokenClassification.from_pretrained(model_dir)
+        if exit_threshold is not None and hasattr(model, "exit_classifiers"):
+            model.exit_threshold = exit_threshold
+    model.to(device)
+    model.eval()
+    return tokenizer, model
+
+
+def iter_records(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            yield json.loads(line)
+
+
+def iter_chunks(records, chunk_size):
+    chunk = []
+    for obj in records:
+        chunk.append(obj)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def predict_one(text, tokenizer, model, max_length=128, device="cpu"):
+    with profiling.stage("tokenize"):
+        enc = tokenizer(
+            text,
+            return_offsets_mapping=True,
+            truncation=True,
+            max_length=max_length,
+            return_tensors="pt",
+        )
+        offsets = enc["offset_mapping"][0].tolist()
+        input_ids = enc["input_ids"].to(device)
+        attention_mask = enc["attention_mask"].to(device)
+
+    with torch.no_grad():
+        with profiling.stage("forward"):
+            out = model(input_ids=input_ids, attention_mask=attention_mask)
+            logits = out.logits[0]
+        with profiling.stage("argmax"):
+            pred_ids = logits.argmax(dim=-1).cpu().tolist()
+
+    with profiling.stage("decode"):
+        spans = bio_to_spans(text, offsets, pred_ids)
+    profiling.step()
+    return spans
+
+
+def predict_timed(records, tokenizer, model, max_length=128, on_forward=None):
+    """
+    Batch-1 pass used by the export / quantization / early-exit checks: returns
+    per-utterance logits, predicted spans keyed by id and forward latencies
+    (ms). `on_forward()` runs after each untimed forward pass, e.g. to read
+    per-utterance model state.
+    """
+    logits_all, pred, times_ms = [], {}, []
+    for obj in records:
+        enc = tokenizer(obj["text"], return_offsets_mapping=True, truncation=True,
+                        max_length=max_length, return_tensors="pt")
+        start = time.perf_counter()
+        with torch.no_grad():
+            logits = model(input_ids=enc["input_ids"], attention_mask=enc["attention_mask"]).logits[0]
+        times_ms.append((time.perf_counter() - start) * 1000.0)
+        if on_forward is not None:
+            on_forward()
+        logits_all.append(logits)
+        pred[obj["id"]] = bio_to_spans(
+            obj["text"], enc["offset_mapping"][0].tolist(), logits.argmax(-1).tolist())
+    return logits_all, pred, times_ms
+
+
+def forward_sorted(enc, tokenizer, model, device="cpu", batch_size=32):
+    """
+    Runs the already-tokenized (unpadded) sequences in `enc` through the model
+    in batches of similar length, padding each batch only to its own longest
+    sequence. Returns the argmax label ids per sequence as numpy arrays, trimmed
+    to its length.
+    """
+    n_seqs = len(enc["input_ids"])
+    order = sorted(range(n_seqs), key=lambda i: len(enc["input_ids"][i]))
+    results = [None] * n_seqs
+
+    for b in range(0, len(order), batch_size):
+        idx = order[b:b + batch_size]
+        with profiling.stage("pad"):
+            padded = tokenizer.pad(
+                {
+                    "input_ids": [enc["input_ids"][i] for i in idx],
+                    "attention_mask": [enc["attention_mask"][i] for i in idx],
+                },
+                return_tensors="pt",
+            )
+            input_ids = padded["input_ids"].to(device)
+            attention_mask = padded["attention_mask"].to(device)
+
+        with torch.no_grad():
+            with profiling.stage("forward"):
+                out = model(input_ids=input_ids, attention_mask=attention_mask)
+            with profiling.stage("argmax"):
+                pred_ids = out.logits.argmax(dim=-1).cpu().numpy()
+
+        for row, i in enumerate(idx):
+            results[i] = pred_ids[row, :len(enc["input_ids"][i])]
+        profiling.step()
+
+    return results
+
+
+def predict_batch(texts, tokenizer, model, max_length=128, device="cpu", batch_size=32):
+    """
+    Tokenize all texts once and run them length-sorted through `forward_sorted`.
+    Returns spans in the same order as `texts`.
+    """
+    with profiling.stage("tokenize"):
+        enc = tokenizer(
+            texts,
+            return_offsets_mapping=True,
+            truncation=True,
+            max_length=max_length,
+        )
+    pred_ids = forward_sorted(enc, tokenizer, model, device, batch_size)
+    with profiling.stage("decode"):
+        return batch_bio_to_spans(pred_ids, enc["offset_mapping"])
+
+
+def merge_windows(windows):
+    """
+    `windows` holds (offsets, label_ids, is_first, is_last) for the overlapping
+    windows of one text, in order. Every token that appears in several windows
+    keeps the label from the window where it sits furthest from a cut edge (the
+    text's own start/end is not a cut). Returns deduplicated (offsets, label_ids)
+    sorted by character position, ready for `bio_to_spans`.
+    """
+    best = {}
+    for offsets, label_ids, is_first, is_last in windows:
+        content = [k for k, (s, e) in enumerate(offsets) if not (s == 0 and e == 0)]
+        if not content:
+            continue
+        lo, hi = content[0], content[-1]
+        for k in content:
+            left = float("inf") if is_first else k - lo
+            right = float("inf") if is_last else hi - k
+            score = min(left, right)
+            key = tuple(offsets[k])
+            if key not in best or score > best[key][0]:
+                best[key] = (score, label_ids[k])
+    keys = sorted(best)
+    return keys, [best[k][1] for k in keys]
+
+
+def predict_windowed(texts, tokenizer, model, max_length=128, stride=32, device="cpu",
+                     batch_size=32):
+    """
+    Splits texts longer than `max_length` tokens into windows that overlap by
+    `stride` tokens, runs all windows of all texts as length-sorted batches and
+    merges them back per text, so entities past the first window are kept and
+    offsets stay on the original text.
+    """
+    with profiling.stage("tokenize"):
+        enc = tokenizer(
+            texts,
+            return_offsets_mapping=True,
+            truncation=True,
+            max_length=max_length,
+            stride=stride,
+            return_overflowing_tokens=True,
+        )
+    pred_ids = forward_sorted(enc, tokenizer, model, device, batch_size)
+    sample_map = enc["overflow_to_sample_mapping"]
+
+    per_text = [[] for _ in texts]
+    for w, i in enumerate(sample_map):
+        per_text[i].append(w)
+
+    merged_offsets, merged_ids = [], []
+    for ws in per_text:
+        windows = [
+            (enc["offset_mapping"][w], pred_ids[w], n == 0, n == len(ws) - 1)
+            for n, w in enumerate(ws)
+        ]
+        with profiling.stage("merge_windows"):
+            offsets, label_ids = merge_windows(windows)
+        merged_offsets.append(offsets)
+        merged_ids.append(label_ids)
+    with profiling.stage("decode"):
+        return batch_bio_to_spans(merged_ids, merged_offsets)
+
+
+def iter_predictions(records, tokenizer, model, max_length=128, device="cpu",
+                     batch_size=1, chunk_size=None, stride=None, cache=None):
+    """
+    Lazily yields (id, ents) in input order, so callers can stream results out
+    without holding the whole input or output in memory. With `stride` set,
+    long texts are split into overlapping windows (see `predict_windowed`).
+    With a `PredictionCache`, only texts not seen before reach the model.
+    """
+    if cache is not None:
+        yield from _iter_cached(records, tokenizer, model, max_length, device, batch_size,
+                                chunk_size, stride, cache)
+        return
+
+    if stride is not None:
+        # all windows of one text always run together, even at batch_size 1
+        for chunk in iter_chunks(records, chunk_size or 32 * max(1, batch_size)):
+            texts = [obj["text"] for obj in chunk]
+            all_spans = predict_windowed(texts, tokenizer, model, max_length, stride, device,
+                                         max(1, batch_size))
+            for obj, spans in zip(chunk, all_spans):
+                yield obj["id"], spans_to_ents(spans)
+        return
+
+    if batch_size <= 1:
+        for obj in records:
+            spans = predict_one(obj["text"], tokenizer, model, max_length, device)
+            yield obj["id"], spans_to_ents(spans)
+        return
+
+    for chunk in iter_chunks(records, chunk_size or 32 * batch_size):
+        texts = [obj["text"] for obj in chunk]
+        all_spans = predict_batch(texts, tokenizer, model, max_length, device, batch_size)
+        for obj, spans in zip(chunk, all_spans):
+            yield obj["id"], spans_to_ents(spans)
+
+
+def predict_cached(texts, tokenizer, model, max_length=128, device="cpu", batch_size=32,
+                   stride=None, cache=None):
+    """
+    `predict_batch` / `predict_windowed` behind a `PredictionCache`: looks every
+    text up first and runs only the distinct misses through the model.
+    """
+    keys = [cache.key(t) for t in texts]
+    spans = [cache.get(k) for k in keys]
+    todo = {}
+    for i, k in enumerate(keys):
+        if spans[i] is None and k not in todo:
+            todo[k] = texts[i]
+    if todo:
+        miss_texts = list(todo.values())
+        if stride is not None:
+            computed = predict_windowed(miss_texts, tokenizer, model, max_length, stride, device,
+                                        batch_size)
+        else:
+            computed = predict_batch(miss_texts, tokenizer, model, max_length, device, batch_size)
+        fresh = dict(zip(todo, computed))
+        for k, v in fresh.items():
+            cache.put(k, v)
+        spans = [s if s is not None else fresh[k] for s, k in zip(spans, keys)]
+    return spans
+
+
+def _iter_cached(records, tokenizer, model, max_length, device, batch_size, chunk_size, stride,
+                 cache):
+    batch_size = max(1, batch_size)
+    for chunk in iter_chunks(records, chunk_size or 32 * batch_size):
+        texts = [obj["text"] for obj in chunk]
+        all_spans = predict_cached(texts, tokenizer, model, max_length, device, batch_size,
+                                   stride, cache)
+        for obj, spans in zip(chunk, all_spans):
+            yield obj["id"], spans_to_ents(spans)
+
+
+_worker = {}
+
+
+def _init_worker(load_kwargs, max_length, batch_size, num_threads, loaded, stride=None):
+    torch.set_num_threads(num_threads)
+    torch.set_num_interop_threads(1)
+    try:
+        tokenizer, model = load_model(device="cpu", num_threads=num_threads, **load_kwargs)
+    except BaseException:
+        loaded.put(traceback.format_exc())
+        raise
+    _worker.update(tokenizer=tokenizer, model=model, max_length=max_length, batch_size=batch_size,
+                   stride=stride)
+    loaded.put(None)
+
+
+def _predict_shard(shard):
+    w = _worker
+    return list(iter_predictions(shard, w["tokenizer"], w["model"], w["max_length"], "cpu",
+                                 w["batch_size"], stride=w["stride"]))
+
+
+def _wait_loaded(loaded, workers, timeout):
+    """
+    Blocks until the first `workers` processes report their model loaded.
+    Raises RuntimeError with the worker's traceback if a load fails, or when
+    they are not all up within `timeout` seconds. Replacement workers started
+    later report too, but nothing waits on them.
+    """
+    deadline = time.monotonic() + timeout
+    for n in range(workers):
+        try:
+            error = loaded.get(timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+            raise RuntimeError(f"only {n} of {workers} workers loaded the model "
+                               f"within {timeout:g}s") from None
+        if error is not None:
+            raise RuntimeError(f"a worker failed to load the model:\n{error}")
+
+
+def iter_predictions_parallel(records, load_kwargs, workers, threads_per_worker,
+                              max_length=128, batch_size=1, shard_size=256, on_ready=None,
+                              stride=None, load_timeout=600):
+    """
+    Splits `records` into shards of `shard_size` and predicts them in a pool of
+    `workers` processes, each with its own model copy pinned to
+    `threads_per_worker` intra-op threads. Results are yielded in input order;
+    at most 2 * workers shards are in flight, so memory stays bounded.
+    """
+    ctx = mp.get_context("spawn")
+    loaded = ctx.Queue()
+    with ctx.Pool(workers, initializer=_init_worker,
+                  initargs=(load_kwargs, max_length, batch_size, threads_per_worker, loaded,
+                            stride)) as pool:
+        _wait_loaded(loaded, workers, load_timeout)  # every worker has its model loaded
+        if on_ready is not None:
+            on_ready()
+        pending = deque()
+        for shard in iter_chunks(records, shard_size):
+            pending.append(pool.apply_async(_predict_shard, (shard,)))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+        pool.close()
+        pool.join()
+
+
+def scaling_table(records, load_kwargs, grid, max_length=128, batch_size=1, shard_size=256,
+                  stride=None):
+    print(f"{'workers':>7} {'threads':>7} {'utt/s':>10} {'speedup':>8}")
+    base = None
+    for workers, threads in grid:
+        t0 = [None]
+
+        def started():
+            t0[0] = time.perf_counter()
+
+        n = 0
+        for _ in iter_predictions_parallel(records, load_kwargs, workers, threads, max_length,
+                                           batch_size, shard_size, on_ready=started,
+                                           stride=stride):
+            n += 1
+        rate = n / max(time.perf_counter() - t0[0], 1e-9)
+        base = base or rate
+        print(f"{workers:7d} {threads:7d} {rate:10.1f} {rate / base:7.2f}x")
+
+
+def _rfind_newline(f, pos, block=1 << 16):
+    """Offset of the last newline before `pos`, reading backwards in blocks; -1 if none."""
+    while pos > 0:
+        start = max(0, pos - block)
+        f.seek(start)
+        i = f.read(pos - start).rfind(b"\n")
+        if i >= 0:
+            return start + i
+        pos = start
+    return -1
+
+
+def last_written_id(path):
+    """
+    Returns the id of the last complete line of a streamed JSONL output and
+    truncates a trailing partial line left behind by a crash. Only the tail of
+    the file is read, so resuming costs the same however large the output is.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        end = _rfind_newline(f, size) + 1
+        if end < size:
+            f.truncate(end)
+        while end > 0:
+            start = _rfind_newline(f, end - 1) + 1
+            f.seek(start)
+            line = f.read(end - start)
+            if line.strip():
+                return json.loads(line)["id"]
+            end = start
+    return None
+
+
+def skip_through(records, uid):
+    records = iter(records)
+    for obj in records:
+        if obj["id"] == uid:
+            return records
+    raise ValueError(f"cannot resume: id {uid!r} from the existing output is not in the input")
+
+
+def write_stream(preds, path, flush_every=1000, append=False):
+    n = 0
+    with open(path, "a" if append else "w", encoding="utf-8") as f:
+        block = []
+        for uid, ents in preds:
+            block.append(json.dumps({"id": uid, "entities": ents}, ensure_ascii=False))
+            if len(block) >= flush_every:
+                f.write("\n".join(block) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+                n += len(block)
+                block = []
+        if block:
+            f.write("\n".join(block) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+            n += len(block)
+    return n
+
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--model_dir", default="out")
@@ -52,58 +528,122 @@ def main():
     ap.add_argument("--input", default="data/dev.jsonl")
     ap.add_argument("--output", default="out/dev_pred.json")
     ap.add_argument("--max_length", type=int, default=128)
-    ap.add_argument(
-        "--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    ap.add_argument("--batch_size", type=int, default=1,
+                    help="utterances per forward pass; 1 keeps the single-item loop")
+    ap.add_argument("--chunk_size", type=int, default=None,
+                    help="utterances read and length-sorted at a time (default: 32 * batch_size)")
+    ap.add_argument("--stride", type=int, default=None,
+                    help="enable sliding-window inference for texts longer than --max_length, "
+                         "with this many tokens of overlap between windows")
+    ap.add_argument("--stream", action="store_true",
+                    help="write one JSON line per utterance as it is predicted (default for .jsonl outputs)")
+    ap.add_argument("--flush_every", type=int, default=1000,
+                    help="streamed lines per flushed block")
+    ap.add_argument("--resume", action="store_true",
+                    help="with --stream, continue after the last id already in --output")
+    ap.add_argument("--cache_size", type=int, default=0,
+                    help="LRU cache of predictions for repeated utterances (0 disables)")
+    ap.add_argument("--cache_file", default=None,
+                    help="persist the cache here between runs; dropped when the checkpoint changes")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="worker processes, each with its own model copy (CPU only)")
+    ap.add_argument("--threads_per_worker", type=int, default=None,
+                    help="torch intra-op threads per worker (default: cores // workers)")
+    ap.add_argument("--shard_size", type=int, default=256,
+                    help="utterances per shard handed to a worker")
+    ap.add_argument("--scaling", default=None,
+                    help="print a workers x threads throughput table instead of writing output, "
+                         "e.g. '1x8,2x4,4x2,8x1'")
+    ap.add_argument("--backend", choices=["torch", "onnxruntime", "fast"], default="torch",
+                    help="fast: --model_dir is an artifact written by src/export_fast.py")
+    ap.add_argument("--onnx_path", default=None, help="defaults to <model_dir>/model.onnx")
+    ap.add_argument("--quantized", action="store_true",
+                    help="load the int8 artifact written by src/quantize.py")
+    ap.add_argument("--exit_threshold", type=float, default=None,
+                    help="confidence threshold for early-exit checkpoints (train.py --early_exit)")
+    ap.add_argument("--device", default=None,
+                    help="default: cuda when available, cpu for --backend fast")
+    profiling.add_profile_args(ap)
+    ap.add_argument("--profile_dir", default=None, help="defaults to <output dir>/profile")
     args = ap.parse_args()
+    if args.device is None:
+        args.device = "cuda" if torch.cuda.is_available() and args.backend != "fast" else "cpu"
+    stream = args.stream or args.output.endswith(".jsonl")
+    if args.resume and not stream:
+        # a single JSON object is rewritten from scratch, which would discard the existing output
+        ap.error("--resume requires streaming output (--stream or a .jsonl --output)")
 
-    tokenizer = AutoTokenizer.from_pretrained(
-        args.model_dir if args.model_name is None else args.model_name)
-    model = AutoModelForTokenClassification.from_pretrained(args.model_dir, ignore_mismatched_sizes=True)
-    model.to(args.device)
-    model.eval()
+    load_kwargs = dict(model_dir=args.model_dir, model_name=args.model_name, backend=args.backend,
+                       onnx_path=args.onnx_path, quantized=args.quantized,
+                       exit_threshold=args.exit_threshold)
 
-    results = {}
+    if args.scaling:
+        grid = [tuple(int(x) for x in cell.split("x")) for cell in args.scaling.split(",")]
+        records = list(iter_records(args.input))
+        scaling_table(records, load_kwargs, grid, args.max_length, args.batch_size, args.shard_size,
+                      args.stride)
+        return
 
-    with open(args.input, "r", encoding="utf-8") as f:
-        for line in f:
-            obj = json.loads(line)
-            text = obj["text"]
-            uid = obj["id"]
-
-            enc = tokenizer(
-                text,
-                return_offsets_mapping=True,
-                truncation=True,
-                max_length=args.max_length,
-                return_tensors="pt",
-            )
-            offsets = enc["offset_mapping"][0].tolist()
-            input_ids = enc["input_ids"].to(args.device)
-            attention_mask = enc["attention_mask"].to(args.device)
+    if args.profile and args.workers > 1:
+        ap.error("--profile only covers the main process; use --workers 1")
 
-            with torch.no_grad():
-                out = model(input_ids=input_ids, attention_mask=attention_mask)
-                logits = out.logits[0]
-                pred_ids = logits.argmax(dim=-1).cpu().tolist()
-
-            spans = bio_to_spans(text, offsets, pred_ids)
-            ents = []
-            for s, e, lab in spans:
-                ents.append(
-                    {
-                        "start": int(s),
-                        "end": int(e),
-                        "label": lab,
-                        "pii": bool(label_is_pii(lab)),
-                    }
-                )
-            results[uid] = ents
+    if args.cache_size > 0 and args.workers > 1:
+        ap.error("--cache_size is not supported with --workers > 1")
+
+    if args.workers <= 1:
+        tokenizer, model = load_model(device=args.device, **load_kwargs)
+
+    cache = None
+    if args.cache_size > 0:
+        from cache import PredictionCache, fingerprint_for, tokenizer_lowercases
+        fold_case = tokenizer_lowercases(tokenizer)
+        fingerprint = fingerprint_for(args.model_dir, fold_case=fold_case,
+                                      max_length=args.max_length, model_name=args.model_name,
+                                      backend=args.backend, onnx_path=args.onnx_path,
+                                      quantized=args.quantized, stride=args.stride,
+                                      exit_threshold=args.exit_threshold)
+        cache = PredictionCache(args.cache_size, fingerprint, args.cache_file, fold_case)
 
     os.makedirs(os.path.dirname(args.output), exist_ok=True)
-    with open(args.output, "w", encoding="utf-8") as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
+    records = iter_records(args.input)
+    resumed_from = last_written_id(args.output) if stream and args.resume else None
+    if resumed_from is not None:
+        records = skip_through(records, resumed_from)
+        print(f"Resuming after id {resumed_from}")
+
+    profile_dir = args.profile_dir or os.path.join(os.path.dirname(args.output), "profile")
+    with profiling.session(args.profile, profile_dir, "predict", args.profile_wait,
+                           args.profile_warmup, args.profile_steps):
+        start = time.perf_counter()
+        if args.workers > 1:
+            threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // args.workers)
+            print(f"Using {args.workers} workers x {threads} threads")
+            preds = iter_predictions_parallel(records, load_kwargs, args.workers, threads,
+                                              args.max_length, args.batch_size, args.shard_size,
+                                              stride=args.stride)
+        else:
+            preds = iter_predictions(records, tokenizer, model, args.max_length, args.device,
+                                     args.batch_size, args.chunk_size, args.stride, cache)
+
+        if stream:
+            n = write_stream(preds, args.output, args.flush_every, append=resumed_from is not None)
+            elapsed = time.perf_counter() - start
+        else:
+            results = dict(preds)
+            n = len(results)
+            elapsed = time.perf_counter() - start
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
 
-    print(f"Wrote predictions for {len(results)} utterances to {args.output}")
+    print(f"Wrote predictions for {n} utterances to {args.output}")
+    print(f"Throughput: {n / max(elapsed, 1e-9):.1f} utterances/sec "
+          f"(batch_size={args.batch_size}, {elapsed:.2f}s)")
+    if cache is not None:
+        st = cache.stats()
+        print(f"Cache: {st['hits']} hits, {st['misses']} misses, {st['evictions']} evictions "
+              f"({st['hit_rate']:.1%} hit rate, {st['entries']}/{st['max_entries']} entries)")
+        if args.cache_file:
+            cache.save()
 
 
 if __name__ == "__main__":
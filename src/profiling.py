@@ -0,0 +1,116 @@
+import os
+import json
+import time
+from contextlib import contextmanager, nullcontext
+from collections import defaultdict
+
+import torch
+
+_NULL = nullcontext()
+_active = None
+
+
+class Profile:
+    """
+    One profiling session. A `torch.profiler` schedule skips `wait` steps,
+    warms up for `warmup` and records the next `active` ones, then writes a
+    Chrome trace and a per-operator table (sorted by self CPU time) to
+    `out_dir`. Separately, every `stage(...)` block is wall-clock timed for
+    the whole session, so time spent outside the recorded window still shows
+    up in the per-stage breakdown.
+    """
+
+    def __init__(self, out_dir, name, wait=2, warmup=2, active=10):
+        self.out_dir = out_dir
+        self.name = name
+        self.stage_ms = defaultdict(float)
+        self.stage_calls = defaultdict(int)
+        self.exported = False
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.prof = torch.profiler.profile(
+            activities=activities,
+            schedule=torch.profiler.schedule(wait=wait, warmup=warmup, active=active, repeat=1),
+            on_trace_ready=self._export,
+            record_shapes=True,
+        )
+
+    def _path(self, suffix):
+        return os.path.join(self.out_dir, f"{self.name}_{suffix}")
+
+    def _export(self, prof):
+        prof.export_chrome_trace(self._path("trace.json"))
+        table = prof.key_averages().table(sort_by="self_cpu_time_total", row_limit=50)
+        with open(self._path("ops.txt"), "w", encoding="utf-8") as f:
+            f.write(table)
+        self.exported = True
+
+    def __enter__(self):
+        global _active
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.start = time.perf_counter()
+        self.prof.__enter__()
+        _active = self
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        _active = None
+        self.prof.__exit__(*exc)
+        wall_ms = (time.perf_counter() - self.start) * 1000.0
+        stages = {
+            name: {"calls": self.stage_calls[name], "total_ms": ms,
+                   "mean_ms": ms / self.stage_calls[name], "share": ms / wall_ms}
+            for name, ms in self.stage_ms.items()
+        }
+        with open(self._path("stages.json"), "w", encoding="utf-8") as f:
+            json.dump({"wall_ms": wall_ms, "stages": stages}, f, indent=2)
+
+        print(f"\nStage times over the whole {self.name} run ({wall_ms / 1000:.2f}s wall):")
+        print(f"  {'stage':16s} {'calls':>7} {'total ms':>10} {'mean ms':>9} {'share':>6}")
+        for name, st in sorted(stages.items(), key=lambda kv: -kv[1]["total_ms"]):
+            print(f"  {name:16s} {st['calls']:7d} {st['total_ms']:10.1f} {st['mean_ms']:9.3f} "
+                  f"{st['share'] * 100:5.1f}%")
+        if self.exported:
+            print(f"Wrote {self._path('trace.json')} (open in chrome://tracing or Perfetto) "
+                  f"and {self._path('ops.txt')}")
+        else:
+            print("No profiler trace: the run had fewer steps than wait + warmup + active")
+        print(f"Wrote {self._path('stages.json')}")
+        return False
+
+    def step(self):
+        self.prof.step()
+
+    @contextmanager
+    def stage(self, name):
+        with torch.profiler.record_function(name):
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.stage_ms[name] += (time.perf_counter() - start) * 1000.0
+                self.stage_calls[name] += 1
+
+
+def stage(name):
+    """Times a block under the active session; free when not profiling."""
+    return _NULL if _active is None else _active.stage(name)
+
+
+def step():
+    if _active is not None:
+        _active.step()
+
+
+def session(enabled, out_dir, name, wait=2, warmup=2, active=10):
+    return Profile(out_dir, name, wait, warmup, active) if enabled else nullcontext()
+
+
+def add_profile_args(ap):
+    ap.add_argument("--profile", action="store_true",
+                    help="torch.profiler trace + per-op table + stage times")
+    ap.add_argument("--profile_wait", type=int, default=2, help="steps skipped before profiling")
+    ap.add_argument("--profile_warmup", type=int, default=2)
+    ap.add_argument("--profile_steps", type=int, default=10, help="steps recorded in the trace")
@@ -0,0 +1,160 @@
+import os
+import json
+import argparse
+
+import torch
+
+from dataset import PIIDataset, make_loader
+from eval_span_f1 import load_gold, compute_metrics
+from labels import LABELS
+from latency_stats import summarize
+from model import prune_heads
+from predict import iter_records, load_model, predict_timed
+from train import train_epochs
+
+REPORT_FILE = "pruning.json"
+
+
+def head_importance(model, train_dl, device="cpu", max_batches=None):
+    """
+    Gradient of the training loss w.r.t. a per-head gate, accumulated as
+    |dL/dgate| over `max_batches` batches (Michel et al., 2019). The gate
+    multiplies each head's slice of the input to `out_lin`, so it is exactly
+    "how much the loss moves if this head is switched off". Scores are
+    normalised per layer. Returns a [n_layers, n_heads] tensor.
+    """
+    layers = model.distilbert.transformer.layer
+    n_heads = model.config.n_heads
+    gates = torch.ones(len(layers), n_heads, device=device, requires_grad=True)
+    scores = torch.zeros(len(layers), n_heads, device=device)
+
+    def gate_hook(idx):
+        def hook(module, inputs):
+            x = inputs[0]
+            gated = x.view(*x.shape[:-1], n_heads, -1) * gates[idx].view(n_heads, 1)
+            return (gated.view(x.shape),)
+
+        return hook
+
+    handles = [layer.attention.out_lin.register_forward_pre_hook(gate_hook(i))
+               for i, layer in enumerate(layers)]
+    model.eval()  # no dropout, so the scores are deterministic
+    try:
+        for step, batch in enumerate(train_dl):
+            if max_batches is not None and step >= max_batches:
+                break
+            out = model(input_ids=batch["input_ids"].to(device),
+                        attention_mask=batch["attention_mask"].to(device),
+                        labels=batch["labels"].to(device))
+            gates.grad = None
+            out.loss.backward()
+            scores += gates.grad.abs()
+    finally:
+        for h in handles:
+            h.remove()
+        model.zero_grad(set_to_none=True)
+
+    return scores / scores.norm(dim=-1, keepdim=True).clamp_min(1e-12)
+
+
+def select_heads(scores, keep):
+    """
+    Heads to remove so that `keep` heads remain in total, dropping the least
+    important first but always leaving at least one head per layer.
+    """
+    n_layers, n_heads = scores.shape
+    if not n_layers <= keep <= n_layers * n_heads:
+        raise ValueError(f"head budget must be between {n_layers} and {n_layers * n_heads}, got {keep}")
+    protected = {(l, int(scores[l].argmax())) for l in range(n_layers)}
+    order = sorted(((float(scores[l, h]), l, h) for l in range(n_layers) for h in range(n_heads)
+                    if (l, h) not in protected))
+    heads = {}
+    for _, l, h in order[:n_layers * n_heads - keep]:
+        heads.setdefault(l, []).append(h)
+    return heads
+
+
+def evaluate(records, gold, tokenizer, model, max_length):
+    predict_timed(records[:5], tokenizer, model, max_length)  # warmup
+    _, pred, times_ms = predict_timed(records, tokenizer, model, max_length)
+    return compute_metrics(gold, pred), summarize(times_ms)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model_dir", default="out", help="fine-tuned checkpoint to prune")
+    ap.add_argument("--train", default="data/train.jsonl")
+    ap.add_argument("--dev", default="data/dev.jsonl")
+    ap.add_argument("--out_dir", default="out_pruned",
+                    help="one checkpoint per budget is written to <out_dir>/heads_<N>")
+    ap.add_argument("--budgets", default="48,36,24,18,12",
+                    help="comma-separated numbers of attention heads to keep (whole model)")
+    ap.add_argument("--score_batches", type=int, default=100,
+                    help="train batches used to score head importance")
+    ap.add_argument("--epochs", type=int, default=1, help="fine-tuning epochs after pruning")
+    ap.add_argument("--lr", type=float, default=3e-5)
+    ap.add_argument("--batch_size", type=int, default=8)
+    ap.add_argument("--max_length", type=int, default=128)
+    ap.add_argument("--data_cache_dir", default=".cache/tokenized",
+                    help="memory-mapped tokenized datasets are kept here ('' to disable)")
+    ap.add_argument("--report", default=None, help=f"defaults to <out_dir>/{REPORT_FILE}")
+    ap.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = ap.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    tokenizer, model = load_model(args.model_dir, device=args.device)
+    if getattr(model.config, "head_pruning", None):
+        raise SystemExit(f"{args.model_dir} is already pruned; start from the unpruned checkpoint")
+
+    train_ds = PIIDataset(args.train, tokenizer, LABELS, max_length=args.max_length, is_train=True,
+                          cache_dir=args.data_cache_dir or None)
+    train_dl = make_loader(train_ds, tokenizer.pad_token_id, args.batch_size)
+    records = list(iter_records(args.dev))
+    gold = load_gold(args.dev)
+
+    scores = head_importance(model, train_dl, args.device, args.score_batches).cpu()
+    n_layers, n_heads = scores.shape
+    print("Head importance (rows = layers):")
+    for l in range(n_layers):
+        print(f"  layer {l}: " + " ".join(f"{s:.2f}" for s in scores[l].tolist()))
+
+    model.to("cpu")
+    m, lat = evaluate(records, gold, tokenizer, model, args.max_length)
+    rows = [{"heads_kept": n_layers * n_heads, "heads_removed": 0, "head_pruning": {},
+             "path": args.model_dir, "latency_ms": lat, "metrics": m}]
+
+    for keep in [int(x) for x in args.budgets.split(",")]:
+        heads = select_heads(scores, keep)
+        model = load_model(args.model_dir, device=args.device)[1]
+        prune_heads(model, heads)
+        if args.epochs > 0:
+            train_epochs(model, train_dl, args.epochs, args.lr, args.device)
+
+        path = os.path.join(args.out_dir, f"heads_{keep}")
+        model.save_pretrained(path)
+        tokenizer.save_pretrained(path)
+
+        # measure what predict.py will actually load, not the in-memory model
+        model = load_model(path, device="cpu")[1]
+        m, lat = evaluate(records, gold, tokenizer, model, args.max_length)
+        rows.append({"heads_kept": keep, "heads_removed": n_layers * n_heads - keep,
+                     "head_pruning": model.config.head_pruning, "path": path,
+                     "latency_ms": lat, "metrics": m})
+        print(f"Saved {keep}-head model to {path}")
+
+    print(f"\n{'heads':>5} {'removed':>7} {'p50 ms':>7} {'p95 ms':>7} {'PII P':>6} {'PII R':>6} "
+          f"{'PII F1':>6} {'Macro-F1':>8}")
+    for r in rows:
+        m, lat = r["metrics"], r["latency_ms"]
+        print(f"{r['heads_kept']:5d} {r['heads_removed']:7d} {lat['p50']:7.2f} {lat['p95']:7.2f} "
+              f"{m['pii']['precision']:6.3f} {m['pii']['recall']:6.3f} {m['pii']['f1']:6.3f} "
+              f"{m['macro_f1']:8.3f}")
+
+    report = args.report or os.path.join(args.out_dir, REPORT_FILE)
+    with open(report, "w", encoding="utf-8") as f:
+        json.dump({"scores": scores.tolist(), "budgets": rows}, f, indent=2)
+    print(f"Wrote report to {report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import os
+import json
+import argparse
+
+import torch
+from transformers import AutoConfig
+
+from eval_span_f1 import load_gold, compute_metrics
+from latency_stats import summarize
+from model import model_from_config
+from predict import load_model, iter_records, predict_timed
+
+QUANTIZED_FILE = "model_int8.pt"
+REPORT_FILE = "quantization.json"
+
+
+def quantize_linear(model):
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_quantized(model_dir, path=None):
+    """
+    Rebuild the fp32 architecture from config.json, swap in dynamic int8 Linear
+    modules and load the saved quantized state dict into them.
+    """
+    path = path or os.path.join(model_dir, QUANTIZED_FILE)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found; run src/quantize.py first")
+    config = AutoConfig.from_pretrained(model_dir)
+    model = model_from_config(config)
+    model.eval()
+    model = quantize_linear(model)
+    # packed int8 params are not plain tensors, so weights_only loading rejects them
+    model.load_state_dict(torch.load(path, map_location="cpu", weights_only=False))
+    return model
+
+
+def calibration_feeds(path, tokenizer, max_length=128, limit=200, input_names=None):
+    feeds = []
+    for i, obj in enumerate(iter_records(path)):
+        if i >= limit:
+            break
+        enc = tokenizer(obj["text"], truncation=True, max_length=max_length, return_tensors="np")
+        feed = {"input_ids": enc["input_ids"], "attention_mask": enc["attention_mask"]}
+        if input_names is not None:
+            feed = {k: v for k, v in feed.items() if k in input_names}
+        feeds.append(feed)
+    return feeds
+
+
+def quantize_static_onnx(fp32_path, out_path, tokenizer, calib_path, max_length, limit):
+    import onnxruntime as ort
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    if not os.path.exists(fp32_path):
+        raise FileNotFoundError(f"{fp32_path} not found; run src/export_onnx.py first")
+    sess = ort.InferenceSession(fp32_path, providers=["CPUExecutionProvider"])
+    input_names = {i.name for i in sess.get_inputs()}
+
+    class Reader(CalibrationDataReader):
+        # one utterance per calibration batch
+        def __init__(self, feeds):
+            self._it = iter(feeds)
+
+        def get_next(self):
+            return next(self._it, None)
+
+    feeds = calibration_feeds(calib_path, tokenizer, max_length, limit, input_names)
+    reader = Reader(feeds)
+    quantize_static(
+        fp32_path,
+        out_path,
+        reader,
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        weight_type=QuantType.QInt8,
+        activation_type=QuantType.QInt8,
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--mode", choices=["dynamic", "static"], default="dynamic",
+                    help="dynamic: torch int8 Linear layers -> model_int8.pt; "
+                         "static: onnxruntime QDQ calibrated on --calib -> model.int8.onnx")
+    ap.add_argument("--dev", default="data/dev.jsonl")
+    ap.add_argument("--calib", default="data/train.jsonl")
+    ap.add_argument("--calib_size", type=int, default=200)
+    ap.add_argument("--max_length", type=int, default=128)
+    ap.add_argument("--min_pii_precision", type=float, default=0.80,
+                    help="refuse to publish if dev PII precision of the int8 model is below this")
+    ap.add_argument("--max_p95_ms", type=float, default=None,
+                    help="also refuse to publish if the int8 batch-1 p95 latency is above this")
+    args = ap.parse_args()
+
+    tokenizer, fp32 = load_model(args.model_dir)
+    records = list(iter_records(args.dev))
+    gold = load_gold(args.dev)
+
+    if args.mode == "dynamic":
+        out_path = os.path.join(args.model_dir, QUANTIZED_FILE)
+        tmp_path = out_path + ".tmp"
+        torch.save(quantize_linear(fp32).state_dict(), tmp_path)
+        int8 = load_quantized(args.model_dir, tmp_path)
+        flag = "--quantized"
+    else:
+        from onnx_backend import ONNX_FILE, ONNX_INT8_FILE, OnnxTokenClassifier
+        out_path = os.path.join(args.model_dir, ONNX_INT8_FILE)
+        tmp_path = out_path + ".tmp"
+        quantize_static_onnx(os.path.join(args.model_dir, ONNX_FILE), tmp_path, tokenizer,
+                             args.calib, args.max_length, args.calib_size)
+        int8 = OnnxTokenClassifier(tmp_path)
+        flag = "--backend onnxruntime --quantized"
+
+    for m in (fp32, int8):
+        predict_timed(records[:5], tokenizer, m, args.max_length)
+    _, fp32_pred, fp32_ms = predict_timed(records, tokenizer, fp32, args.max_length)
+    _, int8_pred, int8_ms = predict_timed(records, tokenizer, int8, args.max_length)
+
+    fp32_m = compute_metrics(gold, fp32_pred)
+    int8_m = compute_metrics(gold, int8_pred)
+    fp32_lat = summarize(fp32_ms)
+    int8_lat = summarize(int8_ms)
+
+    print(f"\n{'':12s} {'fp32':>9s} {'int8':>9s} {'delta':>9s}")
+    for name, a, b in [
+        ("PII P", fp32_m["pii"]["precision"], int8_m["pii"]["precision"]),
+        ("PII R", fp32_m["pii"]["recall"], int8_m["pii"]["recall"]),
+        ("PII F1", fp32_m["pii"]["f1"], int8_m["pii"]["f1"]),
+        ("Macro-F1", fp32_m["macro_f1"], int8_m["macro_f1"]),
+    ]:
+        print(f"{name:12s} {a:9.3f} {b:9.3f} {b - a:+9.3f}")
+    for q in ("p50", "p95"):
+        a, b = fp32_lat[q], int8_lat[q]
+        print(f"{q + ' (ms)':12s} {a:9.2f} {b:9.2f} {b - a:+9.2f}")
+
+    pii_p = int8_m["pii"]["precision"]
+    failures = []
+    if pii_p < args.min_pii_precision:
+        failures.append(f"int8 PII precision {pii_p:.3f} < {args.min_pii_precision:.2f}")
+    if args.max_p95_ms is not None and int8_lat["p95"] > args.max_p95_ms:
+        failures.append(f"int8 p95 {int8_lat['p95']:.2f} ms > {args.max_p95_ms:.2f} ms")
+    passed = not failures
+    retired = None
+    if passed:
+        os.replace(tmp_path, out_path)
+    else:
+        os.remove(tmp_path)
+        if os.path.exists(out_path):
+            # an int8 model published from an earlier checkpoint must not stay loadable
+            retired = out_path + ".stale"
+            os.replace(out_path, retired)
+
+    report = {
+        "mode": args.mode,
+        "artifact": os.path.basename(out_path),
+        "min_pii_precision": args.min_pii_precision,
+        "max_p95_ms": args.max_p95_ms,
+        "published": passed,
+        "live_artifact": os.path.basename(out_path) if passed else None,
+        "retired_artifact": os.path.basename(retired) if retired else None,
+        "fp32": {"metrics": fp32_m, "latency_ms": fp32_lat},
+        "int8": {"metrics": int8_m, "latency_ms": int8_lat},
+    }
+    with open(os.path.join(args.model_dir, REPORT_FILE), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    if not passed:
+        if retired:
+            print(f"\nMoved the previously published {out_path} to {retired}")
+        raise SystemExit("Not publishing: " + "; ".join(failures))
+    print(f"\nPublished {out_path}; load it with {flag}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+
+from predict import load_model, predict_batch, spans_to_ents
+
+
+class _Request:
+    __slots__ = ("text", "done", "result", "error")
+
+    def __init__(self, text):
+        self.text = text
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Single scheduler thread that owns the model. Incoming requests are queued;
+    the scheduler blocks for the first one, then keeps collecting until either
+    `max_batch_size` requests are waiting or `max_wait_ms` has passed since the
+    first one arrived, and runs them as one padded forward pass.
+    """
+
+    def __init__(self, tokenizer, model, max_length=128, device="cpu",
+                 max_batch_size=16, max_wait_ms=2.0, cache=None):
+        self.tokenizer = tokenizer
+        self.cache = cache
+        self.model = model
+        self.max_length = max_length
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.requests = 0
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, text, timeout=None):
+        if self.cache is not None:
+            # hits are answered on the request thread without queueing
+            spans = self.cache.get(self.cache.key(text))
+            if spans is not None:
+                return spans_to_ents(spans)
+        req = _Request(text)
+        self.queue.put(req)
+        if not req.done.wait(timeout):
+            raise TimeoutError("prediction timed out")
+        if req.error is not None:
+            raise req.error
+        return req.result
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    batch.append(self.queue.get_nowait())
+                else:
+                    batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            try:
+                texts = [r.text for r in batch]
+                if self.cache is not None:
+                    # submit() already counted these as misses; run each distinct text once
+                    keys = [self.cache.key(t) for t in texts]
+                    uniq = dict(zip(keys, texts))
+                    computed = predict_batch(list(uniq.values()), self.tokenizer, self.model,
+                                             self.max_length, self.device, batch_size=len(uniq))
+                    fresh = dict(zip(uniq, computed))
+                    for k, v in fresh.items():
+                        self.cache.put(k, v)
+                    all_spans = [fresh[k] for k in keys]
+                else:
+                    all_spans = predict_batch(texts, self.tokenizer, self.model, self.max_length,
+                                              self.device, batch_size=len(batch))
+                for req, spans in zip(batch, all_spans):
+                    req.result = spans_to_ents(spans)
+            except Exception as e:  # surface to every waiting caller
+                for req in batch:
+                    req.error = e
+            self.batches += 1
+            self.requests += len(batch)
+            for req in batch:
+                req.done.set()
+
+
+def make_handler(batcher, request_timeout, tcp=True):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # headers and body go out in separate writes; avoid the Nagle/delayed-ACK stall
+        disable_nagle_algorithm = tcp
+
+        def _send_json(self, code, obj):
+            body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                health = {
+                    "status": "ok",
+                    "requests": batcher.requests,
+                    "batches": batcher.batches,
+                    "avg_batch_size": batcher.requests / max(1, batcher.batches),
+                }
+                if batcher.cache is not None:
+                    health["cache"] = batcher.cache.stats()
+                self._send_json(200, health)
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/predict":
+                self._send_json(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                obj = json.loads(self.rfile.read(length) or b"{}")
+                text = obj["text"]
+            except (ValueError, KeyError, TypeError):
+                self._send_json(400, {"error": "expected JSON body with a 'text' field"})
+                return
+            try:
+                ents = batcher.submit(text, timeout=request_timeout)
+            except TimeoutError as e:
+                self._send_json(503, {"error": str(e)})
+                return
+            except Exception as e:
+                self._send_json(500, {"error": str(e)})
+                return
+            out = {"entities": ents}
+            if "id" in obj:
+                out["id"] = obj["id"]
+            self._send_json(200, out)
+
+        def address_string(self):
+            # unix sockets have no peer address
+            return self.client_address[0] if self.client_address else "unix"
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ""
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--model_name", default=None)
+    ap.add_argument("--max_length", type=int, default=128)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--unix_socket", default=None,
+                    help="serve HTTP on this unix socket path instead of host/port")
+    ap.add_argument("--max_batch_size", type=int, default=16)
+    ap.add_argument("--max_wait_ms", type=float, default=2.0)
+    ap.add_argument("--request_timeout", type=float, default=10.0)
+    ap.add_argument("--cache_size", type=int, default=0,
+                    help="LRU cache of predictions for repeated utterances (0 disables)")
+    ap.add_argument("--cache_file", default=None,
+                    help="load/save the cache here; dropped when the checkpoint changes")
+    ap.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = ap.parse_args()
+
+    tokenizer, model = load_model(args.model_dir, args.model_name, args.device)
+
+    cache = None
+    if args.cache_size > 0:
+        from cache import PredictionCache, fingerprint_for, tokenizer_lowercases
+        fold_case = tokenizer_lowercases(tokenizer)
+        # the server always runs the plain torch model without windows or early exit
+        fingerprint = fingerprint_for(args.model_dir, fold_case=fold_case,
+                                      max_length=args.max_length, model_name=args.model_name)
+        cache = PredictionCache(args.cache_size, fingerprint, args.cache_file, fold_case)
+    batcher = MicroBatcher(tokenizer, model, args.max_length, args.device,
+                           args.max_batch_size, args.max_wait_ms, cache)
+    handler = make_handler(batcher, args.request_timeout, tcp=not args.unix_socket)
+
+    if args.unix_socket:
+        if os.path.exists(args.unix_socket):
+            os.unlink(args.unix_socket)
+        server = ThreadingUnixHTTPServer(args.unix_socket, handler)
+        where = f"unix:{args.unix_socket}"
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), handler)
+        where = f"http://{args.host}:{args.port}"
+
+    print(f"Serving {args.model_dir} on {where} "
+          f"(max_batch_size={args.max_batch_size}, max_wait_ms={args.max_wait_ms})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if cache is not None and args.cache_file:
+            cache.save()
+        if args.unix_socket and os.path.exists(args.unix_socket):
+            os.unlink(args.unix_socket)
+
+
+if __name__ == "__main__":
+    main()
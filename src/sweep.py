@@ -0,0 +1,263 @@
+import os
+import csv
+import sys
+import json
+import time
+import random
+import argparse
+import itertools
+import statistics
+import traceback
+import multiprocessing as mp
+from contextlib import redirect_stderr, redirect_stdout
+
+import torch
+
+LEADERBOARD_FILE = "leaderboard.json"
+SEARCH_SPACE = ("model_name", "lr", "epochs", "batch_size", "max_length")
+FIELDS = ("rank", "trial", *SEARCH_SPACE, "status", "epochs_run", "pii_precision", "pii_f1",
+          "macro_f1", "p95_ms", "train_s", "path")
+
+
+def trial_grid(args):
+    """Cartesian product of the comma-separated search-space options, optionally subsampled."""
+    cast = {"model_name": str, "lr": float, "epochs": int, "batch_size": int, "max_length": int}
+    axes = [[cast[k](v) for v in str(getattr(args, k)).split(",")] for k in SEARCH_SPACE]
+    grid = [dict(zip(SEARCH_SPACE, values)) for values in itertools.product(*axes)]
+    if args.max_trials and len(grid) > args.max_trials:
+        grid = random.Random(args.seed).sample(grid, args.max_trials)
+    return [{"trial": i, **cfg} for i, cfg in enumerate(grid)]
+
+
+def core_slots(parallel):
+    """Disjoint CPU sets, one per concurrent trial."""
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else \
+        list(range(os.cpu_count()))
+    per = max(1, len(cores) // parallel)
+    return [cores[i * per:(i + 1) * per] or cores for i in range(parallel)]
+
+
+def pretokenize(trials, args):
+    """Builds the shared train/dev token caches once per (tokenizer, max_length) before any trial starts."""
+    from transformers import AutoTokenizer
+    from dataset import PIIDataset
+    from labels import LABELS
+
+    for model_name, max_length in sorted({(t["model_name"], t["max_length"]) for t in trials}):
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        PIIDataset(args.train, tokenizer, LABELS, max_length=max_length, cache_dir=args.data_cache_dir)
+        PIIDataset(args.dev, tokenizer, LABELS, max_length=max_length, is_train=False,
+                   cache_dir=args.data_cache_dir)
+
+
+class MedianStopper:
+    """
+    Median stopping rule: after `grace` epochs, a trial stops when its dev
+    score is below the median score at the same epoch of the trials that have
+    already ended (finished or stopped), once at least `min_peers` of those
+    reached that epoch. Comparing only with ended trials' histories keeps the
+    decision independent of which concurrent trial happens to report first;
+    the first trials to end always run to completion. Histories live in a
+    manager dict shared by all trial processes.
+    """
+
+    def __init__(self, histories, grace=1, min_peers=2):
+        self.histories = histories
+        self.grace = grace
+        self.min_peers = min_peers
+
+    def report(self, trial, epoch, score):
+        if epoch <= self.grace:
+            return False
+        peers = [h[epoch - 1] for t, h in self.histories.items() if t != trial and len(h) >= epoch]
+        if len(peers) < self.min_peers:
+            return False
+        return score < statistics.median(peers)
+
+    def finish(self, trial, scores):
+        self.histories[trial] = list(scores)
+
+
+_worker = {}
+
+
+def _init_worker(slots, stopper, args):
+    _worker.update(slots=slots, stopper=stopper, args=args)
+
+
+def run_trial(cfg):
+    """One training run in a pool process, pinned to a free core slot; output goes to train.log."""
+    from transformers import AutoTokenizer
+    from dataset import PIIDataset, make_loader
+    from labels import LABELS
+    from model import create_model
+    from train import DevEvaluator, train_epochs
+
+    args, stopper = _worker["args"], _worker["stopper"]
+    cores = _worker["slots"].get()
+    path = os.path.join(args.out_dir, f"trial_{cfg['trial']:03d}")
+    os.makedirs(path, exist_ok=True)
+    result = {**cfg, "status": "failed", "epochs_run": 0, "path": path, "dev": []}
+    try:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cores)
+        torch.set_num_threads(len(cores))
+        with open(os.path.join(path, "train.log"), "w", encoding="utf-8") as log, \
+                redirect_stdout(log), redirect_stderr(log):
+            print(f"trial {cfg} on cores {cores}")
+            tokenizer = AutoTokenizer.from_pretrained(cfg["model_name"])
+            train_ds = PIIDataset(args.train, tokenizer, LABELS, max_length=cfg["max_length"],
+                                  cache_dir=args.data_cache_dir)
+            train_dl = make_loader(train_ds, tokenizer.pad_token_id, cfg["batch_size"],
+                                   seed=args.seed)
+            evaluator = DevEvaluator(args.dev, tokenizer, cfg["max_length"], "cpu",
+                                     cache_dir=args.data_cache_dir)
+            model = create_model(cfg["model_name"])
+
+            def on_epoch_end(stats):
+                m = evaluator(model)
+                result["dev"].append({"epoch": stats["epoch"], "seconds": stats["seconds"], **m})
+                result["epochs_run"] = stats["epoch"]
+                print(f"dev after epoch {stats['epoch']}: PII P={m['pii']['precision']:.3f} "
+                      f"F1={m['pii']['f1']:.3f}")
+                stop = stopper.report(cfg["trial"], stats["epoch"], m["pii"]["f1"])
+                if stop:
+                    print("below the median of the other trials: stopping")
+                    result["status"] = "stopped"
+                return stop
+
+            start = time.perf_counter()
+            train_epochs(model, train_dl, cfg["epochs"], cfg["lr"], "cpu",
+                         on_epoch_end=on_epoch_end)
+            result["train_s"] = time.perf_counter() - start
+            stopper.finish(cfg["trial"], [d["pii"]["f1"] for d in result["dev"]])
+            if result["status"] != "stopped":
+                result["status"] = "done"
+                model.save_pretrained(path)
+                tokenizer.save_pretrained(path)
+    except Exception:
+        result["error"] = traceback.format_exc()
+    finally:
+        if result["status"] != "done":
+            result["path"] = ""  # no checkpoint was saved there
+        _worker["slots"].put(cores)
+    return result
+
+
+def latency_p95(path, max_length, dev, runs, warmup, threads):
+    """Batch-1 end-to-end p95 (ms) as measured by measure_latency.py."""
+    from latency_stats import summarize
+    from measure_latency import measure
+    from predict import iter_records, load_model
+
+    torch.set_num_threads(threads)
+    tokenizer, model = load_model(path)
+    texts = [obj["text"] for obj in iter_records(dev)]
+    times, _ = measure(texts, tokenizer, model, max_length, "cpu", runs, warmup)
+    return summarize(times["end_to_end"])["p95"]
+
+
+def leaderboard(results, rank_by):
+    other = "pii_f1" if rank_by == "pii_precision" else "pii_precision"
+    rows = []
+    for r in results:
+        last = r["dev"][-1] if r["dev"] else None
+        rows.append({k: r.get(k) for k in FIELDS if k in r} | {
+            "pii_precision": last["pii"]["precision"] if last else None,
+            "pii_f1": last["pii"]["f1"] if last else None,
+            "macro_f1": last["macro_f1"] if last else None,
+            "p95_ms": r.get("p95_ms"),
+            "train_s": r.get("train_s"),
+        })
+    # finished trials first, then by the ranking metric and the other PII metric
+    score = lambda x, k: -1.0 if x[k] is None else x[k]
+    rows.sort(key=lambda x: (x["status"] == "done", score(x, rank_by), score(x, other)), reverse=True)
+    for i, row in enumerate(rows):
+        row["rank"] = i + 1
+    return rows
+
+
+def _fmt(value, width, digits):
+    return f"{value:{width}.{digits}f}" if value is not None else "-".rjust(width)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--train", default="data/train.jsonl")
+    ap.add_argument("--dev", default="data/dev.jsonl")
+    ap.add_argument("--out_dir", default="sweep")
+    ap.add_argument("--model_name", default="distilbert-base-uncased", help="comma-separated")
+    ap.add_argument("--lr", default="5e-5,3e-5", help="comma-separated")
+    ap.add_argument("--epochs", default="3", help="comma-separated")
+    ap.add_argument("--batch_size", default="8,16", help="comma-separated")
+    ap.add_argument("--max_length", default="128", help="comma-separated")
+    ap.add_argument("--max_trials", type=int, default=None,
+                    help="random subset of the grid (default: every combination)")
+    ap.add_argument("--parallel", type=int, default=2,
+                    help="trials run at once; cores are split between them")
+    ap.add_argument("--grace_epochs", type=int, default=1,
+                    help="epochs before a trial can be stopped by the median rule")
+    ap.add_argument("--min_peers", type=int, default=2,
+                    help="ended trials that must have reached an epoch before stopping on it")
+    ap.add_argument("--rank_by", choices=["pii_precision", "pii_f1"], default="pii_precision")
+    ap.add_argument("--latency_top", type=int, default=5,
+                    help="measure p95 for this many top finished trials (0 to skip)")
+    ap.add_argument("--latency_runs", type=int, default=200)
+    ap.add_argument("--latency_threads", type=int, default=1)
+    ap.add_argument("--data_cache_dir", default=".cache/tokenized")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    trials = trial_grid(args)
+    slots = core_slots(args.parallel)
+    print(f"{len(trials)} trials, {args.parallel} at a time on {len(slots[0])} core(s) each")
+    pretokenize(trials, args)
+
+    ctx = mp.get_context("spawn")
+    with ctx.Manager() as manager:
+        slot_queue = manager.Queue()
+        for s in slots:
+            slot_queue.put(s)
+        stopper = MedianStopper(manager.dict(), args.grace_epochs, args.min_peers)
+        start = time.perf_counter()
+        results = []
+        with ctx.Pool(args.parallel, initializer=_init_worker,
+                      initargs=(slot_queue, stopper, args), maxtasksperchild=1) as pool:
+            for r in pool.imap_unordered(run_trial, trials):
+                results.append(r)
+                last = r["dev"][-1]["pii"] if r["dev"] else {"precision": 0.0, "f1": 0.0}
+                print(f"[{time.perf_counter() - start:7.0f}s] trial {r['trial']:3d} "
+                      f"{r['status']:7s} after {r['epochs_run']} epoch(s): "
+                      f"PII P={last['precision']:.3f} F1={last['f1']:.3f}")
+                if r["status"] == "failed":
+                    print(r["error"], file=sys.stderr)
+        wall_s = time.perf_counter() - start
+
+    rows = leaderboard(results, args.rank_by)
+    for row in [r for r in rows if r["status"] == "done"][:args.latency_top]:
+        row["p95_ms"] = latency_p95(row["path"], row["max_length"], args.dev, args.latency_runs,
+                                    args.latency_runs // 10, args.latency_threads)
+
+    print(f"\nLeaderboard ({len(results)} trials in {wall_s / 60:.1f} min, ranked by {args.rank_by}):")
+    print(f"{'#':>3} {'trial':>5} {'lr':>8} {'ep':>3} {'bs':>3} {'len':>4} {'status':>7} {'run':>3} "
+          f"{'PII P':>6} {'PII F1':>6} {'Macro':>6} {'p95 ms':>7}  model")
+    for r in rows:
+        print(f"{r['rank']:3d} {r['trial']:5d} {r['lr']:8.1e} {r['epochs']:3d} {r['batch_size']:3d} "
+              f"{r['max_length']:4d} {r['status']:>7} {r['epochs_run']:3d} "
+              f"{_fmt(r['pii_precision'], 6, 3)} {_fmt(r['pii_f1'], 6, 3)} {_fmt(r['macro_f1'], 6, 3)} "
+              f"{_fmt(r['p95_ms'], 7, 2)}  {r['model_name']}")
+
+    with open(os.path.join(args.out_dir, "leaderboard.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    report = os.path.join(args.out_dir, LEADERBOARD_FILE)
+    with open(report, "w", encoding="utf-8") as f:
+        json.dump({"rank_by": args.rank_by, "wall_s": wall_s, "parallel": args.parallel,
+                   "leaderboard": rows, "trials": results}, f, indent=2)
+    print(f"Wrote {report} and leaderboard.csv")
+
+
+if __name__ == "__main__":
+    main()
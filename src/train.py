@@ -1,13 +1,25 @@
 import os
+import json
+import math
+import time
 import argparse
+import numpy as np
 import torch
-from torch.utils.data import DataLoader
+import torch.nn.functional as F
 from tqdm import tqdm
 from transformers import AutoTokenizer, get_linear_schedule_with_warmup
 
-from dataset import PIIDataset, collate_batch
+from dataset import PIIDataset, make_loader
+from decode import batch_bio_to_spans
+from eval_span_f1 import load_gold, compute_metrics
 from labels import LABELS
-from model import create_model
+from latency_stats import summarize
+from model import create_model, create_student
+from predict import iter_records, load_model, predict_timed
+import profiling
+
+DISTILL_REPORT_FILE = "distillation.json"
+TRAIN_REPORT_FILE = "train_report.json"
 
 
 def parse_args():
@@ -17,63 +29,393 @@ def parse_args():
     ap.add_argument("--dev", default="data/dev.jsonl")
     ap.add_argument("--out_dir", default="out")
     ap.add_argument("--batch_size", type=int, default=8)
+    ap.add_argument("--max_tokens", type=int, default=None,
+                    help="batch by padded-token budget instead of a fixed --batch_size")
+    ap.add_argument("--bucket_size", type=int, default=None,
+                    help="rows shuffled together and sorted by length per window "
+                         "(default 100 * batch_size; 0 = plain shuffle)")
+    ap.add_argument("--num_workers", type=int, default=0, help="DataLoader worker processes")
+    ap.add_argument("--prefetch_factor", type=int, default=2, help="batches queued per worker")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--precision", choices=["fp32", "bf16"], default="fp32",
+                    help="bf16: autocast forward/loss to bfloat16 (CPU or CUDA); weights stay fp32")
+    ap.add_argument("--compile", action="store_true", help="train through torch.compile")
+    ap.add_argument("--grad_accum", type=int, default=1,
+                    help="batches per optimizer step (effective batch = batch_size * grad_accum)")
+    ap.add_argument("--baseline", default=None,
+                    help=f"{TRAIN_REPORT_FILE} of an fp32 run to hold dev F1 against")
+    ap.add_argument("--f1_tolerance", type=float, default=0.01,
+                    help="largest allowed PII / macro F1 drop vs --baseline")
     ap.add_argument("--epochs", type=int, default=3)
     ap.add_argument("--lr", type=float, default=5e-5)
     ap.add_argument("--max_length", type=int, default=128)
+    ap.add_argument("--data_cache_dir", default=".cache/tokenized",
+                    help="memory-mapped tokenized datasets are kept here ('' to disable)")
+    ap.add_argument("--early_exit", action="store_true",
+                    help="train intermediate-layer exit classifiers jointly (DistilBERT only)")
+    ap.add_argument("--distill_from", default=None,
+                    help="fine-tuned teacher checkpoint (e.g. out); trains a smaller student instead")
+    ap.add_argument("--student_layers", type=int, default=2)
+    ap.add_argument("--student_dim", type=int, default=None,
+                    help="student hidden size (default: the teacher's, which lets it copy teacher layers)")
+    ap.add_argument("--student_heads", type=int, default=None)
+    ap.add_argument("--student_hidden_dim", type=int, default=None, help="student FFN size")
+    ap.add_argument("--temperature", type=float, default=2.0)
+    ap.add_argument("--alpha", type=float, default=0.5,
+                    help="weight of the soft-label KL loss; 1 - alpha goes to the hard BIO labels")
+    ap.add_argument("--min_pii_precision", type=float, default=0.80,
+                    help="dev PII precision a checkpoint should reach to be kept as the best "
+                         "(and below which a distilled student is flagged)")
+    ap.add_argument("--eval_every", type=int, default=0,
+                    help="also evaluate on --dev every N optimizer steps (default: once per epoch)")
+    ap.add_argument("--patience", type=int, default=0,
+                    help="stop after this many dev evaluations without improvement (0 = never)")
+    ap.add_argument("--eval_batch_size", type=int, default=64)
     ap.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    profiling.add_profile_args(ap)
     return ap.parse_args()
 
 
-def main():
-    args = parse_args()
-    os.makedirs(args.out_dir, exist_ok=True)
+def distill_loss(student_logits, teacher_logits, labels, attention_mask, temperature, alpha):
+    """
+    alpha * T^2 * KL(teacher || student) on temperature-softened token
+    distributions (real tokens only) + (1 - alpha) * cross-entropy on labels.
+    """
+    mask = attention_mask.bool()
+    t = teacher_logits[mask] / temperature
+    s = student_logits[mask] / temperature
+    kl = F.kl_div(F.log_softmax(s, -1), F.log_softmax(t, -1), log_target=True, reduction="batchmean")
+    ce = F.cross_entropy(student_logits.view(-1, student_logits.size(-1)), labels.view(-1))
+    return alpha * temperature ** 2 * kl + (1 - alpha) * ce
 
-    tokenizer = AutoTokenizer.from_pretrained(args.model_name)
-    train_ds = PIIDataset(args.train, tokenizer, LABELS, max_length=args.max_length, is_train=True)
 
-    train_dl = DataLoader(
-        train_ds,
-        batch_size=args.batch_size,
-        shuffle=True,
-        collate_fn=lambda b: collate_batch(b, pad_token_id=tokenizer.pad_token_id),
-    )
+def make_optimizer(model, lr):
+    """AdamW, using the fused single-kernel update where this torch build and device support it."""
+    params = [p for p in model.parameters() if p.requires_grad]
+    try:
+        return torch.optim.AdamW(params, lr=lr, fused=True)
+    except (RuntimeError, TypeError):
+        return torch.optim.AdamW(params, lr=lr)
 
-    model = create_model(args.model_name)
-    model.to(args.device)
-    model.train()
 
-    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr)
-    total_steps = len(train_dl) * args.epochs
+def train_epochs(model, train_dl, epochs, lr, device, teacher=None, temperature=2.0, alpha=0.5,
+                 precision="fp32", compile=False, grad_accum=1, on_epoch_end=None, on_step_end=None):
+    """
+    Trains in place and returns per-epoch stats. `on_step_end(step)` runs
+    after every optimizer step and `on_epoch_end(stats)` after every epoch; a
+    true return value from either stops training there. Time spent in them is
+    reported as `eval_s` and left out of the throughput numbers.
+    """
+    optimizer = make_optimizer(model, lr)
+    total_steps = math.ceil(len(train_dl) / grad_accum) * epochs
     scheduler = get_linear_schedule_with_warmup(
         optimizer, num_warmup_steps=int(0.1 * total_steps), num_training_steps=total_steps
     )
+    # bucketed batches vary in length, so compile for dynamic shapes up front
+    step_model = torch.compile(model, dynamic=True) if compile else model
+    device_type = torch.device(device).type
 
-    for epoch in range(args.epochs):
-        running_loss = 0.0
-        for batch in tqdm(train_dl, desc=f"Epoch {epoch+1}/{args.epochs}"):
-            input_ids = torch.tensor(batch["input_ids"], device=args.device)
-            attention_mask = torch.tensor(batch["attention_mask"], device=args.device)
-            labels = torch.tensor(batch["labels"], device=args.device)
+    def autocast():
+        return torch.autocast(device_type, dtype=torch.bfloat16, enabled=precision == "bf16")
 
-            outputs = model(input_ids=input_ids, attention_mask=attention_mask, labels=labels)
-            loss = outputs.loss
+    step = 0
 
-            optimizer.zero_grad()
-            loss.backward()
+    def optimizer_step():
+        nonlocal step
+        with profiling.stage("optimizer"):
             optimizer.step()
             scheduler.step()
+            optimizer.zero_grad(set_to_none=True)
+        step += 1
+
+    print(f"Training: {precision}, compile={compile}, grad_accum={grad_accum}, "
+          f"fused AdamW={bool(optimizer.defaults.get('fused'))}")
+    history = []
+    for epoch in range(epochs):
+        model.train()  # the epoch callback may have switched to eval
+        running_loss = 0.0
+        n_batches = samples = real_tokens = padded_tokens = 0
+        eval_s = 0.0
+        stop = False
+        start = time.perf_counter()
+        batches = iter(tqdm(train_dl, desc=f"Epoch {epoch+1}/{epochs}"))
+        while True:
+            with profiling.stage("data_wait"):
+                batch = next(batches, None)
+            if batch is None:
+                break
+            with profiling.stage("to_device"):
+                input_ids = batch["input_ids"].to(device, non_blocking=True)
+                attention_mask = batch["attention_mask"].to(device, non_blocking=True)
+                labels = batch["labels"].to(device, non_blocking=True)
 
+            if teacher is None:
+                with profiling.stage("forward"), autocast():
+                    outputs = step_model(input_ids=input_ids, attention_mask=attention_mask,
+                                         labels=labels)
+                    loss = outputs.loss
+            else:
+                with profiling.stage("teacher_forward"), torch.no_grad(), autocast():
+                    teacher_logits = teacher(input_ids=input_ids, attention_mask=attention_mask).logits
+                with profiling.stage("forward"), autocast():
+                    logits = step_model(input_ids=input_ids, attention_mask=attention_mask).logits
+                    loss = distill_loss(logits, teacher_logits, labels, attention_mask,
+                                        temperature, alpha)
+
+            with profiling.stage("backward"):
+                (loss / grad_accum).backward()
             running_loss += loss.item()
+            n_batches += 1
+            samples += batch["input_ids"].size(0)
+            real_tokens += int(batch["attention_mask"].sum())
+            padded_tokens += batch["input_ids"].numel()
+            profiling.step()
+            if n_batches % grad_accum == 0:
+                optimizer_step()
+                if on_step_end is not None:
+                    t0 = time.perf_counter()
+                    stop = on_step_end(step)
+                    eval_s += time.perf_counter() - t0
+                    if stop:
+                        break
+        if n_batches % grad_accum:
+            optimizer_step()  # leftover batches at the end of the epoch
+
+        elapsed = time.perf_counter() - start - eval_s
+        stats = {"epoch": epoch + 1, "step": step, "loss": running_loss / max(1, n_batches),
+                 "seconds": elapsed, "samples_per_s": samples / elapsed,
+                 "tokens_per_s": real_tokens / elapsed,
+                 "padding_ratio": 1 - real_tokens / max(1, padded_tokens)}
+        history.append(stats)
+        print(f"Epoch {epoch+1} average loss: {stats['loss']:.4f} | {elapsed:.1f}s, "
+              f"{stats['samples_per_s']:.1f} samples/s, {stats['tokens_per_s']:.0f} tokens/s, "
+              f"padding {stats['padding_ratio'] * 100:.1f}%")
+        if not stop and on_epoch_end is not None:
+            t0 = time.perf_counter()
+            stop = on_epoch_end(stats)
+            eval_s += time.perf_counter() - t0
+        stats["eval_s"] = eval_s
+        if stop:
+            break
+    return history
 
-        avg_loss = running_loss / max(1, len(train_dl))
-        print(f"Epoch {epoch+1} average loss: {avg_loss:.4f}")
 
-    #model.config.pruned = True
+class DevEvaluator:
+    """
+    Span metrics on a dev file that is tokenized once (through the PIIDataset
+    cache) and decoded with `decode.batch_bio_to_spans`, so each evaluation
+    during training only costs the length-sorted forward passes.
+    """
 
+    def __init__(self, path, tokenizer, max_length, device, batch_size=64, cache_dir=None):
+        self.ds = PIIDataset(path, tokenizer, LABELS, max_length=max_length, is_train=False,
+                             cache_dir=cache_dir)
+        self.gold = load_gold(path)
+        self.ids = [self.ds[i]["id"] for i in range(len(self.ds))]
+        order = np.argsort(self.ds.lengths, kind="stable")
+        self.batches = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+        self.pad_token_id = tokenizer.pad_token_id
+        self.device = device
+
+    def __call__(self, model):
+        was_training = model.training
+        model.eval()
+        pred = {}
+        with torch.no_grad():
+            for idx in self.batches:
+                batch = self.ds.padded_batch(idx, self.pad_token_id, offsets=True)
+                logits = model(input_ids=batch["input_ids"].to(self.device),
+                               attention_mask=batch["attention_mask"].to(self.device)).logits
+                spans = batch_bio_to_spans(logits.argmax(-1).cpu().numpy(),
+                                           batch["offset_mapping"].numpy())
+                pred.update(zip((self.ids[i] for i in idx.tolist()), spans))
+        model.train(was_training)
+        return compute_metrics(self.gold, pred)
+
+
+class BestCheckpoint:
+    """
+    Runs the dev evaluations and keeps a CPU copy of the best weights seen.
+    Best is the highest PII F1, preferring evaluations that reach
+    `min_precision` PII precision (precision breaks ties). Returns True from
+    a call once `patience` evaluations in a row failed to improve.
+    """
+
+    def __init__(self, model, evaluator, patience=0, min_precision=0.0):
+        self.model = model
+        self.evaluator = evaluator
+        self.patience = patience
+        self.min_precision = min_precision
+        self.evals = []
+        self.best = None
+        self.best_state = None
+        self.bad = 0
+        self.seconds = 0.0
+
+    def key(self, m):
+        p, f1 = m["pii"]["precision"], m["pii"]["f1"]
+        return (p >= self.min_precision, f1, p)
+
+    def __call__(self, epoch, step):
+        if self.evals and self.evals[-1]["step"] == step:
+            return False  # already evaluated at this step
+        start = time.perf_counter()
+        m = self.evaluator(self.model)
+        better = self.best is None or self.key(m) > self.key(self.best["metrics"])
+        entry = {"epoch": epoch, "step": step, "metrics": m}
+        self.evals.append(entry)
+        if better:
+            self.best, self.bad = entry, 0
+            self.best_state = {k: v.detach().to("cpu", copy=True)
+                               for k, v in self.model.state_dict().items()}
+        else:
+            self.bad += 1
+        seconds = time.perf_counter() - start
+        self.seconds += seconds
+        print(f"dev @ epoch {epoch} step {step}: PII P={m['pii']['precision']:.3f} "
+              f"F1={m['pii']['f1']:.3f} Macro-F1={m['macro_f1']:.3f} ({seconds:.1f}s)"
+              f"{'  *best*' if better else ''}")
+        if self.patience and self.bad >= self.patience:
+            print(f"No improvement in {self.patience} evaluations: stopping early")
+            return True
+        return False
+
+    def restore(self):
+        if self.best_state is not None:
+            self.model.load_state_dict(self.best_state)
+        return self.best
+
+
+def main():
+    args = parse_args()
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    teacher = None
+    if args.distill_from:
+        # the student shares the teacher's tokenizer and label space
+        tokenizer, teacher = load_model(args.distill_from, device=args.device)
+    else:
+        tokenizer = AutoTokenizer.from_pretrained(args.model_name)
+
+    with profiling.session(args.profile, os.path.join(args.out_dir, "profile"), "train",
+                           args.profile_wait, args.profile_warmup, args.profile_steps):
+        with profiling.stage("tokenize"):
+            train_ds = PIIDataset(args.train, tokenizer, LABELS, max_length=args.max_length,
+                                  is_train=True, cache_dir=args.data_cache_dir or None)
+
+        train_dl = make_loader(train_ds, tokenizer.pad_token_id, args.batch_size, args.max_tokens,
+                               args.bucket_size, args.num_workers, args.prefetch_factor,
+                               pin_memory=args.device.startswith("cuda"), seed=args.seed)
+
+        if teacher is not None:
+            model = create_student(teacher, args.student_layers, args.student_dim,
+                                   args.student_heads, args.student_hidden_dim)
+        else:
+            model = create_model(args.model_name, early_exit=args.early_exit)
+        model.to(args.device)
+
+        evaluator = DevEvaluator(args.dev, tokenizer, args.max_length, args.device,
+                                 args.eval_batch_size, cache_dir=args.data_cache_dir or None)
+        best = BestCheckpoint(model, evaluator, args.patience, args.min_pii_precision)
+        epoch = [1]
+
+        def on_step_end(step):
+            return step % args.eval_every == 0 and best(epoch[0], step)
+
+        def on_epoch_end(stats):
+            epoch[0] = stats["epoch"] + 1
+            return best(stats["epoch"], stats["step"])
+
+        history = train_epochs(model, train_dl, args.epochs, args.lr, args.device,
+                               teacher=teacher, temperature=args.temperature, alpha=args.alpha,
+                               precision=args.precision, compile=args.compile,
+                               grad_accum=args.grad_accum, on_epoch_end=on_epoch_end,
+                               on_step_end=on_step_end if args.eval_every else None)
+
+    chosen = best.restore()
+    train_s = sum(e["seconds"] for e in history)
+    print(f"Best dev checkpoint: epoch {chosen['epoch']} step {chosen['step']}. "
+          f"Dev evaluation: {len(best.evals)} runs, {best.seconds:.1f}s "
+          f"({best.seconds / max(train_s, 1e-9) * 100:.1f}% of {train_s:.1f}s training)")
     model.save_pretrained(args.out_dir)
     tokenizer.save_pretrained(args.out_dir)
     print(f"Saved model + tokenizer to {args.out_dir}")
 
+    report(chosen, best, history, args)
+    if teacher is not None:
+        compare(teacher, model, tokenizer, args)
+
+
+def report(chosen, best, history, args):
+    """
+    Writes the per-epoch throughput, every dev evaluation and the saved
+    checkpoint's dev metrics to TRAIN_REPORT_FILE. With --baseline, fails when
+    PII or macro F1 fall more than --f1_tolerance below the baseline run's.
+    """
+    m = chosen["metrics"]
+    print(f"Dev: PII P={m['pii']['precision']:.3f} F1={m['pii']['f1']:.3f} "
+          f"Macro-F1={m['macro_f1']:.3f}")
+    out = {"precision": args.precision, "compile": args.compile, "batch_size": args.batch_size,
+           "max_tokens": args.max_tokens, "grad_accum": args.grad_accum,
+           "torch": torch.__version__, "epochs": history, "dev": m,
+           "best": {"epoch": chosen["epoch"], "step": chosen["step"]},
+           "dev_evals": best.evals, "eval_s": best.seconds}
+    path = os.path.join(args.out_dir, TRAIN_REPORT_FILE)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(out, f, indent=2)
+    print(f"Wrote {path}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            base = json.load(f)
+        print(f"\nCompared with {args.baseline} ({base['precision']}):")
+        print(f"{'':10s} {'base':>6} {'new':>6} {'delta':>7}")
+        failed = []
+        for name, a, b in (("PII F1", base["dev"]["pii"]["f1"], m["pii"]["f1"]),
+                           ("Macro-F1", base["dev"]["macro_f1"], m["macro_f1"])):
+            bad = a - b > args.f1_tolerance
+            print(f"{name:10s} {a:6.3f} {b:6.3f} {b - a:+7.3f}{'  OUT OF TOLERANCE' if bad else ''}")
+            if bad:
+                failed.append(name)
+        base_s = sum(e["seconds"] for e in base["epochs"])
+        new_s = sum(e["seconds"] for e in history)
+        print(f"training time: {base_s:.1f}s -> {new_s:.1f}s ({base_s / new_s:.2f}x)")
+        if failed:
+            raise SystemExit(f"{', '.join(failed)} dropped more than {args.f1_tolerance} "
+                             f"vs {args.baseline}")
+
+
+def compare(teacher, student, tokenizer, args):
+    """Teacher-vs-student batch-1 CPU latency and dev span metrics."""
+    records = list(iter_records(args.dev))
+    gold = load_gold(args.dev)
+    rows = {}
+    for name, model in (("teacher", teacher), ("student", student)):
+        model.to("cpu")
+        model.eval()
+        predict_timed(records[:5], tokenizer, model, args.max_length)  # warmup
+        _, pred, times_ms = predict_timed(records, tokenizer, model, args.max_length)
+        rows[name] = {"n_layers": model.config.n_layers, "dim": model.config.dim,
+                      "params": sum(p.numel() for p in model.parameters()),
+                      "latency_ms": summarize(times_ms), "metrics": compute_metrics(gold, pred)}
+
+    print(f"\n{'':8s} {'layers':>6} {'dim':>4} {'params':>8} {'p50 ms':>7} {'p95 ms':>7} "
+          f"{'PII P':>6} {'PII F1':>6} {'Macro-F1':>8}")
+    for name, r in rows.items():
+        m, lat = r["metrics"], r["latency_ms"]
+        print(f"{name:8s} {r['n_layers']:6d} {r['dim']:4d} {r['params'] / 1e6:7.1f}M {lat['p50']:7.2f} "
+              f"{lat['p95']:7.2f} {m['pii']['precision']:6.3f} {m['pii']['f1']:6.3f} {m['macro_f1']:8.3f}")
+    speedup = rows["teacher"]["latency_ms"]["p95"] / rows["student"]["latency_ms"]["p95"]
+    precision = rows["student"]["metrics"]["pii"]["precision"]
+    print(f"p95 speedup: {speedup:.2f}x")
+    if precision < args.min_pii_precision:
+        print(f"WARNING: student PII precision {precision:.3f} is below {args.min_pii_precision:.2f}")
+
+    report = os.path.join(args.out_dir, DISTILL_REPORT_FILE)
+    with open(report, "w", encoding="utf-8") as f:
+        json.dump({"teacher": args.distill_from, "p95_speedup": speedup, **rows}, f, indent=2)
+    print(f"Wrote comparison to {report}")
+
 
 if __name__ == "__main__":
     main()
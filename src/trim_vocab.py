@@ -0,0 +1,221 @@
+import os
+import sys
+import glob
+import json
+import shutil
+import argparse
+import subprocess
+
+import torch
+from torch import nn
+
+from predict import iter_records, load_model, predict_timed
+
+REPORT_FILE = "vocab_trim.json"
+TOKENIZER_FILES = ("tokenizer.json", "tokenizer_config.json", "special_tokens_map.json", "vocab.txt")
+
+# load a checkpoint in a fresh interpreter, so neither the page cache of this
+# process nor its already-imported modules flatter the numbers. Memory is the
+# RSS growth from loading plus one forward pass (which pages in the mmapped
+# weights), on top of what the imports already cost.
+PROBE = """
+import sys, json, time
+sys.path.insert(0, sys.argv[1])
+from predict import load_model, predict_one
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        return next(int(l.split()[1]) for l in f if l.startswith("VmRSS")) / 1024
+
+base = rss_mb()
+t0 = time.perf_counter()
+tokenizer, model = load_model(sys.argv[2])
+load_s = time.perf_counter() - t0
+predict_one("my name is john and my email is john at gmail dot com", tokenizer, model)
+print(json.dumps({"load_s": load_s, "rss_mb": rss_mb() - base}))
+"""
+
+
+def corpus_texts(patterns, generated=0):
+    """
+    Every text the trimmed model is expected to see: the `text` field of the
+    JSONL files matching `patterns`, plus the templates and entity values of
+    `dataset_generator.py` and `generated` freshly sampled records (which also
+    cover its ASR noise words).
+    """
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            for obj in iter_records(path):
+                yield obj["text"]
+
+    import dataset_generator as gen
+    for template in gen.TEMPLATES:
+        yield gen.PLACEHOLDER_PATTERN.sub(" ", template)
+    for values in gen.ENTITY_VALUES.values():
+        yield from values
+    yield from gen.DIGIT_WORD.values()
+    for i in range(generated):
+        yield gen.make_record(i)["text"]
+
+
+def used_ids(tokenizer, texts, batch_size=1000):
+    ids, batch = set(), []
+    for text in texts:
+        batch.append(text)
+        if len(batch) >= batch_size:
+            for row in tokenizer(batch)["input_ids"]:
+                ids.update(row)
+            batch = []
+    if batch:
+        for row in tokenizer(batch)["input_ids"]:
+            ids.update(row)
+    return ids
+
+
+def safety_ids(tokenizer):
+    """
+    Special tokens and every single-character piece (with and without `##`),
+    so any unseen word still tokenizes into characters rather than [UNK].
+    """
+    keep = set(tokenizer.all_special_ids)
+    for token, i in tokenizer.get_vocab().items():
+        if len(token[2:] if token.startswith("##") else token) == 1:
+            keep.add(i)
+    return keep
+
+
+def _remap_post_processor(node, remap):
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == "ids" and isinstance(value, list):
+                node[key] = [remap[i] for i in value]
+            else:
+                _remap_post_processor(value, remap)
+    elif isinstance(node, list):
+        for item in node:
+            _remap_post_processor(item, remap)
+
+
+def write_tokenizer(src_dir, dst_dir, keep):
+    """
+    Copy the tokenizer files of `src_dir`, keeping only the token ids in
+    `keep` (renumbered in their original order). WordPiece matches the longest
+    vocabulary entry first, so any text whose pieces are all kept tokenizes to
+    the same pieces as before.
+    """
+    remap = {old: new for new, old in enumerate(keep)}
+    with open(os.path.join(src_dir, "tokenizer.json"), "r", encoding="utf-8") as f:
+        spec = json.load(f)
+    if spec["model"]["type"] != "WordPiece":
+        raise ValueError(f"only WordPiece tokenizers are supported, not {spec['model']['type']}")
+
+    spec["model"]["vocab"] = {tok: remap[i] for tok, i in spec["model"]["vocab"].items() if i in remap}
+    for added in spec["added_tokens"]:
+        added["id"] = remap[added["id"]]
+    _remap_post_processor(spec["post_processor"], remap)
+    if spec.get("padding"):
+        spec["padding"]["pad_id"] = remap[spec["padding"]["pad_id"]]
+    with open(os.path.join(dst_dir, "tokenizer.json"), "w", encoding="utf-8") as f:
+        json.dump(spec, f, ensure_ascii=False, indent=2)
+
+    config_path = os.path.join(src_dir, "tokenizer_config.json")
+    if os.path.exists(config_path):
+        with open(config_path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        if "added_tokens_decoder" in config:
+            config["added_tokens_decoder"] = {
+                str(remap[int(i)]): v for i, v in config["added_tokens_decoder"].items()}
+        with open(os.path.join(dst_dir, "tokenizer_config.json"), "w", encoding="utf-8") as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+
+    if os.path.exists(os.path.join(src_dir, "vocab.txt")):
+        by_id = sorted(spec["model"]["vocab"].items(), key=lambda kv: kv[1])
+        with open(os.path.join(dst_dir, "vocab.txt"), "w", encoding="utf-8") as f:
+            f.writelines(tok + "\n" for tok, _ in by_id)
+    if os.path.exists(os.path.join(src_dir, "special_tokens_map.json")):
+        shutil.copy(os.path.join(src_dir, "special_tokens_map.json"), dst_dir)
+
+
+def trim_embeddings(model, keep, pad_id):
+    old = model.get_input_embeddings()
+    new = nn.Embedding(len(keep), old.embedding_dim, padding_idx=pad_id)
+    with torch.no_grad():
+        new.weight.copy_(old.weight[torch.tensor(keep)])
+    model.set_input_embeddings(new)
+    model.config.vocab_size = len(keep)
+    model.config.pad_token_id = pad_id
+    return model
+
+
+def checkpoint_bytes(model_dir):
+    names = ("model.safetensors", "pytorch_model.bin") + TOKENIZER_FILES
+    return sum(os.path.getsize(os.path.join(model_dir, n)) for n in names
+               if os.path.exists(os.path.join(model_dir, n)))
+
+
+def probe_load(model_dir, runs):
+    src = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", PROBE, src, model_dir],
+                             capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    results.sort(key=lambda r: r["load_s"])
+    return results[len(results) // 2]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model_dir", default="out")
+    ap.add_argument("--out_dir", default="out_trimmed")
+    ap.add_argument("--corpora", default="data/*.jsonl",
+                    help="comma-separated globs of JSONL files whose texts must tokenize unchanged")
+    ap.add_argument("--generated", type=int, default=5000,
+                    help="extra dataset_generator.py records to scan")
+    ap.add_argument("--dev", default="data/dev.jsonl", help="predictions on this file must not change")
+    ap.add_argument("--max_length", type=int, default=128)
+    ap.add_argument("--load_runs", type=int, default=3)
+    args = ap.parse_args()
+
+    tokenizer, model = load_model(args.model_dir)
+    vocab_before = len(tokenizer)
+    keep = used_ids(tokenizer, corpus_texts(args.corpora.split(","), args.generated))
+    keep = sorted(keep | safety_ids(tokenizer))
+    print(f"Keeping {len(keep)} of {vocab_before} vocabulary entries")
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    write_tokenizer(args.model_dir, args.out_dir, keep)
+    pad_id = keep.index(tokenizer.pad_token_id)
+    trim_embeddings(model, keep, pad_id)
+    model.save_pretrained(args.out_dir)
+
+    # the trimmed model has to be a drop-in replacement
+    records = list(iter_records(args.dev))
+    _, ref_model = load_model(args.model_dir)
+    new_tokenizer, new_model = load_model(args.out_dir)
+    ref_logits, ref_pred, _ = predict_timed(records, tokenizer, ref_model, args.max_length)
+    new_logits, new_pred, _ = predict_timed(records, new_tokenizer, new_model, args.max_length)
+    max_diff = max(float((a - b).abs().max()) for a, b in zip(ref_logits, new_logits))
+    same = new_pred == ref_pred
+    print(f"Dev predictions identical: {same} (max logit diff {max_diff:.2e})")
+
+    before = {"vocab": vocab_before, "bytes": checkpoint_bytes(args.model_dir),
+              **probe_load(args.model_dir, args.load_runs)}
+    after = {"vocab": len(keep), "bytes": checkpoint_bytes(args.out_dir),
+             **probe_load(args.out_dir, args.load_runs)}
+    print(f"\n{'':8s} {'vocab':>6} {'size MB':>8} {'load s':>7} {'RSS MB':>7}")
+    for name, r in (("original", before), ("trimmed", after)):
+        print(f"{name:8s} {r['vocab']:6d} {r['bytes'] / 2**20:8.1f} {r['load_s']:7.3f} "
+              f"{r['rss_mb']:7.1f}")
+
+    report = os.path.join(args.out_dir, REPORT_FILE)
+    with open(report, "w", encoding="utf-8") as f:
+        json.dump({"source": args.model_dir, "original": before, "trimmed": after,
+                   "dev_identical": same, "max_logit_diff": max_diff}, f, indent=2)
+    print(f"Wrote report to {report}")
+    if not same:
+        raise SystemExit(f"trimmed model changes predictions on {args.dev}")
+
+
+if __name__ == "__main__":
+    main()